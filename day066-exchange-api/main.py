@@ -1,64 +1,88 @@
-import requests
+import argparse
+import os
+from collections import Counter
+from rate_cache import RateCache
+from providers import ProviderError, create_client
+
+# 為替レートAPI（open.er-api.com → 遅い・失敗した場合は Currency API にも同時に問い合わせる）
+# テスト用のサーバーを使う場合は EXCHANGE_API_URL / EXCHANGE_ALT_API_URL で切り替える
+rate_client = create_client()
+
+# 基準通貨ごとのレート表のキャッシュ（次回のAPI更新時刻まで有効。ディスクにも保存して次回の実行で使う）
+# 既定の保存先はユーザーのキャッシュディレクトリ（ソースのディレクトリには書き込まない）
+CACHE_PATH = os.getenv("EXCHANGE_RATE_CACHE",
+                       os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                                    "day066-exchange-api", "rates.json"))
+rate_cache = RateCache(CACHE_PATH or None)
+
+def store_rate_table(base, result):
+    """取得したレート表をキャッシュに保存する"""
+    rates, expires_at, provider = result
+    if expires_at is None:
+        expires_at = rate_cache.expires_at({})
+    rate_cache.put(base, rates, expires_at, source=provider)
+    print(f"✅ {base} のレート表を取得（{provider}）")
+    return rates
+
+def fetch_rate_table(base="USD"):
+    """基準通貨のレート表（全通貨分）を1回のリクエストで取得してキャッシュする"""
+    print(f"🌐 APIにリクエスト中...")
+    try:
+        return store_rate_table(base, rate_client.fetch_table(base))
+    except ProviderError as e:
+        print(f"🚨 API通信エラー: {e}")
 
 def get_exchange_rate(base="USD", target="JPY"):
-    """無料APIを使用した為替レート取得"""
+    """無料APIを使用した為替レート取得
     
-    # 🆓 無料API 1: Open Exchange Rates API (制限あり)
-    url = f"https://open.er-api.com/v6/latest/{base}"
+    キャッシュ済みのレート表があればAPIを呼ばずに返す（基準通貨が異なる表からはクロスレートで計算）。
+    """
+    rate = rate_cache.lookup(base, target)
+    if rate is not None:
+        print(f"💾 キャッシュから取得")
+        print(f"💱 1 {base} = {rate:.4f} {target}")
+        return rate
     
-    try:
-        print(f"🌐 APIにリクエスト中...")
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        # APIレスポンスの構造確認
-        if data.get("result") == "success":
-            rates = data.get("rates", {})
-            if target in rates:
-                rate = rates[target]
-                print(f"💱 1 {base} = {rate:.4f} {target}")
-                return rate
-            else:
-                print(f"❌ {target} の為替レートが見つかりません")
-                print(f"利用可能な通貨: {list(rates.keys())[:10]}...")  # 最初の10個を表示
-        else:
-            print(f"❌ API呼び出しが失敗: {data}")
-            
-    except requests.exceptions.RequestException as e:
-        print(f"🚨 API通信エラー: {e}")
-    except KeyError as e:
-        print(f"🔑 データ構造エラー: {e}")
-    except Exception as e:
-        print(f"❓ 予期しないエラー: {e}")
+    rates = fetch_rate_table(base)
+    if rates is None:
+        return None
+    if target in rates:
+        rate = rates[target]
+        print(f"💱 1 {base} = {rate:.4f} {target}")
+        return rate
+    else:
+        print(f"❌ {target} の為替レートが見つかりません")
+        print(f"利用可能な通貨: {list(rates.keys())[:10]}...")  # 最初の10個を表示
 
-def get_exchange_rate_alternative(base="USD", target="JPY"):
-    """代替無料API"""
+def get_rates(pairs):
+    """複数の通貨ペアのレートをまとめて取得する
     
-    # 🆓 無料API 2: Currency API (GitHub)
-    base_lower = base.lower()
-    target_lower = target.lower()
-    url = f"https://cdn.jsdelivr.net/gh/fawazahmed0/currency-api@1/latest/currencies/{base_lower}/{target_lower}.json"
+    1. キャッシュ済みのレート表（クロスレートを含む）で求められるペアはAPIを呼ばない
+    2. 残りのペアは、最も多く使われる基準通貨のレート表を1回だけ取得して計算する
+    3. それでも求められないペアは、必要な基準通貨のレート表を並行して取得する
     
-    try:
-        print(f"🌐 代替APIにリクエスト中...")
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        if target_lower in data:
-            rate = data[target_lower]
-            print(f"💱 1 {base} = {rate:.4f} {target}")
-            return rate
-        else:
-            print(f"❌ レート情報が見つかりません: {data}")
-            
-    except requests.exceptions.RequestException as e:
-        print(f"🚨 代替API通信エラー: {e}")
-    except Exception as e:
-        print(f"❓ 代替API予期しないエラー: {e}")
+    Returns:
+        dict: (基準通貨, 対象通貨) -> レート（取得できなかった場合はNone）
+    """
+    results = {pair: rate_cache.lookup(*pair) for pair in pairs}
+    missing = [pair for pair, rate in results.items() if rate is None]
+    
+    def fetch(bases):
+        for base, result in rate_client.fetch_tables(bases).items():
+            if isinstance(result, ProviderError):
+                print(f"🚨 {base} のレート表を取得できません: {result}")
+            else:
+                store_rate_table(base, result)
+        for pair in missing:
+            results[pair] = rate_cache.lookup(*pair)
+        return [pair for pair in missing if results[pair] is None]
+    
+    if missing:
+        anchor = Counter(base for base, _ in missing).most_common(1)[0][0]
+        missing = fetch([anchor])
+    if missing:
+        missing = fetch([base for base, _ in missing if base != anchor])
+    return results
 
 def get_multiple_rates():
     """複数の為替レートを取得"""
@@ -70,14 +94,31 @@ def get_multiple_rates():
     ]
     
     print("📊 複数の為替レート取得中...")
-    for base, target in pairs:
+    results = get_rates(pairs)
+    for (base, target), rate in results.items():
         print(f"\n--- {base} → {target} ---")
-        rate = get_exchange_rate(base, target)
         if rate is None:
-            print("⚠️ 代替APIを試します...")
-            get_exchange_rate_alternative(base, target)
+            print(f"❌ {target} の為替レートが取得できませんでした")
+        else:
+            print(f"💱 1 {base} = {rate:.4f} {target}")
+    return results
+
+def print_provider_stats():
+    """プロバイダーごとの呼び出し回数・エラー数・応答時間"""
+    stats = rate_client.stats()
+    print(f"\n📈 APIの統計（代替APIへの同時問い合わせ: {stats['hedged']}回）")
+    for name, provider in stats['providers'].items():
+        print(f"  {name}: 呼び出し {provider['requests']}回 / 採用 {provider['wins']}回 / "
+              f"エラー {provider['errors']}回 / 中断 {provider['abandoned']}回 / "
+              f"p50 {provider['p50_ms']} ms / p95 {provider['p95_ms']} ms")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="為替レート取得アプリ")
+    parser.add_argument("--refresh", action="store_true", help="キャッシュを使わずに取得し直す")
+    args = parser.parse_args()
+    if args.refresh:
+        rate_cache.clear()
+    
     print("為替レート取得アプリ（修正版）")
     print("=" * 40)
     
@@ -87,4 +128,7 @@ if __name__ == "__main__":
     print("\n" + "=" * 40)
     
     # 複数通貨の取得
-    get_multiple_rates()
\ No newline at end of file
+    get_multiple_rates()
+    
+    print(f"\n💾 キャッシュ: {rate_cache.stats()['hits']}回")
+    print_provider_stats()
@@ -0,0 +1,277 @@
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import requests
+
+
+class ProviderError(Exception):
+    """プロバイダーから有効なレート表を取得できなかった"""
+
+
+class Attempt:
+    """1回の問い合わせ（開始時刻と、結果を記録済みか）"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = False
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+class ProviderStats:
+    """プロバイダーごとの呼び出し回数・エラー数・応答時間（直近max_samples件から分位点を計算）
+
+    呼び出し回数は問い合わせの開始時に数えるため、応答を待っている間の遅いプロバイダーも集計に現れる。
+    ヘッジで採用されなかった問い合わせは、打ち切った時点の経過時間を「中断」として記録する。
+    """
+
+    def __init__(self, max_samples=1000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=max_samples)
+        self.requests = 0
+        self.errors = 0
+        self.wins = 0  # 結果が採用された回数
+        self.abandoned = 0  # 応答を待たずに打ち切った回数
+
+    def start(self):
+        """問い合わせの開始を記録してAttemptを返す"""
+        with self._lock:
+            self.requests += 1
+        return Attempt()
+
+    def record(self, attempt, ok):
+        """問い合わせの完了を記録する（打ち切り済みの場合は何もしない）"""
+        seconds = attempt.elapsed()
+        with self._lock:
+            if attempt.finished:
+                return
+            attempt.finished = True
+            if not ok:
+                self.errors += 1
+            self._latencies.append(seconds)
+
+    def record_abandoned(self, attempt):
+        """応答を待たずに打ち切った問い合わせを、その時点の経過時間で記録する"""
+        seconds = attempt.elapsed()
+        with self._lock:
+            if attempt.finished:
+                return
+            attempt.finished = True
+            self.abandoned += 1
+            self._latencies.append(seconds)
+
+    def record_win(self):
+        with self._lock:
+            self.wins += 1
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {'requests': self.requests, 'errors': self.errors, 'wins': self.wins,
+                     'abandoned': self.abandoned}
+
+        def percentile(q):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1)
+
+        stats['error_rate'] = round(stats['errors'] / stats['requests'], 3) if stats['requests'] else 0.0
+        stats['p50_ms'] = percentile(0.5)
+        stats['p95_ms'] = percentile(0.95)
+        return stats
+
+
+class RateProvider(ABC):
+    """為替レートAPIの基底クラス: fetch_table() で基準通貨の全通貨分のレート表を返す"""
+
+    name = 'provider'
+
+    def __init__(self, base_url, timeout=10):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.stats = ProviderStats()
+
+    def fetch_table(self, base, attempt=None):
+        """レート表を取得する（応答時間とエラーを記録する）
+
+        Args:
+            attempt: 呼び出し側で stats.start() 済みの場合はそのAttempt（省略時はここで開始する）
+
+        Returns:
+            tuple: (レート表 {通貨コード: レート}, 有効期限のUNIX時刻 または None)
+        """
+        attempt = attempt or self.stats.start()
+        try:
+            rates, expires_at = self._fetch(base.upper())
+            if not rates:
+                raise ProviderError(f"{self.name}: レート表が空です")
+        except (requests.exceptions.RequestException, KeyError, TypeError, ValueError) as e:
+            self.stats.record(attempt, ok=False)
+            raise ProviderError(f"{self.name}: {e}") from e
+        except ProviderError:
+            self.stats.record(attempt, ok=False)
+            raise
+        self.stats.record(attempt, ok=True)
+        return rates, expires_at
+
+    @abstractmethod
+    def _fetch(self, base):
+        """APIからレート表を取得して (レート表, 有効期限 または None) を返す"""
+
+
+class OpenERProvider(RateProvider):
+    """🆓 無料API 1: Open Exchange Rates API（open.er-api.com）"""
+
+    name = 'open.er-api.com'
+
+    def _fetch(self, base):
+        response = self.session.get(f"{self.base_url}/{base}", timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        if data.get("result") != "success":
+            raise ProviderError(f"{self.name}: API呼び出しが失敗: {data}")
+        return data["rates"], data.get("time_next_update_unix")
+
+
+class CurrencyAPIProvider(RateProvider):
+    """🆓 無料API 2: Currency API（GitHub / jsDelivr）
+
+    /currencies/{base}.json で基準通貨の全通貨分のレート表を返す（通貨コードは小文字）。
+    """
+
+    name = 'currency-api'
+
+    def _fetch(self, base):
+        base_lower = base.lower()
+        response = self.session.get(f"{self.base_url}/{base_lower}.json", timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        rates = {code.upper(): rate for code, rate in data[base_lower].items()
+                 if isinstance(rate, (int, float))}
+        return rates, None
+
+
+class HedgedRateClient:
+    """複数のプロバイダーに「ヘッジ」してレート表を取得する
+
+    先頭のプロバイダーに問い合わせ、hedge_after秒以内に応答がない（または失敗した）場合は
+    次のプロバイダーにも同時に問い合わせ、最初に得られた有効な結果を使う。
+    遅いプロバイダーがあってもタイムアウトまで待たずに代替の結果を返せる。
+    """
+
+    def __init__(self, providers, hedge_after=0.5):
+        self.providers = list(providers)
+        self.hedge_after = hedge_after
+        self._lock = threading.Lock()
+        self.hedged = 0  # 代替プロバイダーにも問い合わせた回数
+
+    def _submit(self, provider, base, attempt):
+        """プロバイダーへの問い合わせをデーモンスレッドで開始する
+
+        採用されなかった遅い問い合わせが終わるのを待たずにプログラムを終了できるよう、
+        ThreadPoolExecutor（終了時にすべての処理を待つ）は使わない。
+        """
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(provider.fetch_table(base, attempt))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name=f'rate-{provider.name}', daemon=True).start()
+        return future
+
+    def fetch_table(self, base):
+        """最初に得られた有効なレート表を返す
+
+        Returns:
+            tuple: (レート表, 有効期限 または None, プロバイダー名)
+
+        Raises:
+            ProviderError: すべてのプロバイダーが失敗した場合
+        """
+        remaining = list(self.providers)
+        running = {}
+        errors = []
+
+        def start_next():
+            provider = remaining.pop(0)
+            # 開始した時点で呼び出し回数に数える（応答が返る前に集計を表示しても現れるように）
+            attempt = provider.stats.start()
+            running[self._submit(provider, base, attempt)] = (provider, attempt)
+
+        start_next()
+        while running:
+            # 次のプロバイダーが残っていればhedge_after秒だけ待ち、なければ完了まで待つ
+            timeout = self.hedge_after if remaining else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider, _ = running.pop(future)
+                try:
+                    rates, expires_at = future.result()
+                except ProviderError as e:
+                    errors.append(str(e))
+                    continue
+                provider.stats.record_win()
+                # 採用されなかった実行中の問い合わせは、この時点までの経過時間で「中断」として記録する
+                for other, attempt in running.values():
+                    other.stats.record_abandoned(attempt)
+                return rates, expires_at, provider.name
+            if remaining and (not done or not running):
+                # 応答が遅い、またはすべて失敗した場合は次のプロバイダーに問い合わせる
+                if running:
+                    with self._lock:
+                        self.hedged += 1
+                start_next()
+        raise ProviderError(" / ".join(errors) or "プロバイダーがありません")
+
+    def fetch_tables(self, bases):
+        """複数の基準通貨のレート表を並行して取得する
+
+        Returns:
+            dict: 基準通貨 -> (レート表, 有効期限, プロバイダー名)。失敗したものは ProviderError
+        """
+        bases = list(dict.fromkeys(bases))
+        results = {}
+        if not bases:
+            return results
+        with ThreadPoolExecutor(max_workers=len(bases)) as executor:
+            futures = {base: executor.submit(self.fetch_table, base) for base in bases}
+            for base, future in futures.items():
+                try:
+                    results[base] = future.result()
+                except ProviderError as e:
+                    results[base] = e
+        return results
+
+    def stats(self):
+        return {
+            'hedged': self.hedged,
+            'providers': {provider.name: provider.stats.snapshot() for provider in self.providers},
+        }
+
+
+def create_client():
+    """環境変数からプロバイダーとヘッジの設定を読み込んで作成する
+
+    EXCHANGE_API_URL / EXCHANGE_ALT_API_URL: 各APIのURL（テスト用サーバーへの切り替え）
+    EXCHANGE_HEDGE_AFTER: 代替APIに問い合わせるまでの待ち時間（秒）
+    EXCHANGE_TIMEOUT: 各APIのタイムアウト（秒）
+    """
+    timeout = float(os.getenv("EXCHANGE_TIMEOUT", 10))
+    return HedgedRateClient(
+        [
+            OpenERProvider(os.getenv("EXCHANGE_API_URL", "https://open.er-api.com/v6/latest"), timeout),
+            CurrencyAPIProvider(os.getenv("EXCHANGE_ALT_API_URL",
+                                          "https://cdn.jsdelivr.net/gh/fawazahmed0/currency-api@1/latest/currencies"),
+                                timeout),
+        ],
+        hedge_after=float(os.getenv("EXCHANGE_HEDGE_AFTER", 0.5)),
+    )
@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+import time
+
+# APIが次回の更新時刻を返さない場合の有効期間（秒）
+DEFAULT_TTL = 60 * 60
+# 次回の更新時刻を過ぎたレート表が返ってきた場合も、この秒数はキャッシュする（APIの連続呼び出しを避ける）
+MIN_TTL = 60
+
+
+class RateCache:
+    """基準通貨ごとの為替レート表のキャッシュ
+
+    - 1回のAPI呼び出しで取得した基準通貨のレート表（全通貨分）をまとめて保持する
+    - 有効期限はAPIの time_next_update_unix（次回の更新時刻）に合わせる
+    - 有効なレート表があれば、基準通貨が異なるペアもクロスレートで計算する
+      （例: USDのレート表から EUR→JPY = rates['JPY'] / rates['EUR']）
+    - pathを指定するとディスクにスナップショットを保存し、次回の実行でも使う
+    """
+
+    def __init__(self, path=None, default_ttl=DEFAULT_TTL):
+        self.path = path
+        self.default_ttl = default_ttl
+        self._tables = {}  # 基準通貨 -> {'rates': {...}, 'expires_at': UNIX時刻, 'source': ...}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path:
+            self._load_snapshot()
+
+    def _load_snapshot(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                tables = json.load(f).get('tables', {})
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"⚠️ キャッシュファイルを読み込めません（無視します）: {e}")
+            return
+        now = time.time()
+        self._tables = {base: table for base, table in tables.items()
+                        if table.get('expires_at', 0) > now and table.get('rates')}
+
+    def _save_snapshot(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'tables': self._tables}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️ キャッシュファイルを保存できません: {e}")
+
+    def expires_at(self, data, now=None):
+        """APIレスポンスから有効期限（UNIX時刻）を求める"""
+        now = time.time() if now is None else now
+        next_update = data.get('time_next_update_unix')
+        if next_update:
+            return max(float(next_update), now + MIN_TTL)
+        return now + self.default_ttl
+
+    def put(self, base, rates, expires_at, source=None):
+        """レート表を保存する（基準通貨自身のレート1を含める）"""
+        rates = dict(rates)
+        rates[base] = 1.0
+        with self._lock:
+            self._tables[base] = {'rates': rates, 'expires_at': expires_at, 'source': source}
+            self._save_snapshot()
+
+    def get_table(self, base):
+        """有効期限内のレート表を返す（なければNone）"""
+        with self._lock:
+            table = self._tables.get(base)
+            if table and table['expires_at'] > time.time():
+                return table['rates']
+        return None
+
+    def lookup(self, base, target):
+        """キャッシュ済みのレート表からレートを求める（直接のレート表を優先し、なければクロスレート）
+
+        Returns:
+            float or None: 1 base あたりの target の量
+        """
+        now = time.time()
+        with self._lock:
+            tables = [self._tables[base]] if base in self._tables else []
+            tables += [table for key, table in self._tables.items() if key != base]
+            for table in tables:
+                if table['expires_at'] <= now:
+                    continue
+                rates = table['rates']
+                if rates.get(base) and target in rates:
+                    self.hits += 1
+                    return rates[target] / rates[base]
+            self.misses += 1
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self._save_snapshot()
+
+    def stats(self):
+        with self._lock:
+            return {'tables': sorted(self._tables), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,108 @@
+# stub_server.py - 動作確認用の為替レートAPIのスタブサーバー
+#
+#   python stub_server.py --primary-latency 3 --alt-latency 0.1
+#   EXCHANGE_API_URL=http://127.0.0.1:8765/v6/latest \
+#   EXCHANGE_ALT_API_URL=http://127.0.0.1:8766/currencies \
+#   EXCHANGE_RATE_CACHE= python main.py
+#
+# 8765番で open.er-api.com 形式（/v6/latest/USD）、
+# 8766番で Currency API 形式（/currencies/usd.json）のレート表を返す。
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 1 USDあたりのレート
+USD_RATES = {'USD': 1.0, 'JPY': 150.0, 'EUR': 0.92, 'GBP': 0.79, 'AUD': 1.52, 'CAD': 1.36}
+
+
+def rates_for(base):
+    return {code: rate / USD_RATES[base] for code, rate in USD_RATES.items()}
+
+
+class StubServer(ThreadingHTTPServer):
+    """latency秒待ってから応答する（failがTrueなら503を返す）スタブサーバー"""
+
+    daemon_threads = True
+
+    def __init__(self, address, style, latency=0.0, fail=False):
+        super().__init__(address, _Handler)
+        self.style = style
+        self.latency = latency
+        self.fail = fail
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        path = '/v6/latest' if self.style == 'open-er' else '/currencies'
+        return f'http://{host}:{port}{path}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        with server._lock:
+            server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+        if server.fail:
+            return self._send(503, {'error': 'unavailable'})
+
+        name = self.path.rstrip('/').rsplit('/', 1)[-1]
+        base = name.removesuffix('.json').upper()
+        if base not in USD_RATES:
+            return self._send(404, {'result': 'error', 'error-type': 'unsupported-code'})
+        rates = rates_for(base)
+        if server.style == 'open-er':
+            now = int(time.time())
+            payload = {'result': 'success', 'base_code': base, 'time_last_update_unix': now,
+                       'time_next_update_unix': now + 3600, 'rates': rates}
+        else:
+            payload = {'date': time.strftime('%Y-%m-%d'),
+                       base.lower(): {code.lower(): rate for code, rate in rates.items()}}
+        self._send(200, payload)
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='為替レートAPIのスタブサーバー')
+    parser.add_argument('--primary-port', type=int, default=8765)
+    parser.add_argument('--alt-port', type=int, default=8766)
+    parser.add_argument('--primary-latency', type=float, default=0.1)
+    parser.add_argument('--alt-latency', type=float, default=0.1)
+    parser.add_argument('--primary-fail', action='store_true', help='メインAPIが503を返す')
+    args = parser.parse_args()
+
+    primary = StubServer(('127.0.0.1', args.primary_port), 'open-er', args.primary_latency, args.primary_fail)
+    alternative = StubServer(('127.0.0.1', args.alt_port), 'currency-api', args.alt_latency)
+    alternative.start()
+    print(f"🧪 メインAPI: {primary.base_url}（遅延 {args.primary_latency}秒）")
+    print(f"🧪 代替API:   {alternative.base_url}（遅延 {args.alt_latency}秒）")
+    try:
+        primary.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,17 @@
 # app.py
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for
+from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, Response, stream_with_context
 import os
 from werkzeug.utils import secure_filename
 import uuid
 from PIL import Image
 import json
+import atexit
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils.image_processor import ImageEditor, SUPPORTED_OPERATIONS, batch_export
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
@@ -19,6 +26,39 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 # ディレクトリが存在しない場合は作成
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# 編集セッション（画像ごとの操作リスト + デコード済み画像のLRUキャッシュ）
+DECODED_CACHE_BYTES = 256 * 1024 * 1024  # 256MB
+editor = ImageEditor(UPLOAD_FOLDER, max_cache_bytes=DECODED_CACHE_BYTES)
+
+# 一括編集の設定（ワーカープロセスは最初のバッチ実行時に起動）
+BATCH_WORKERS = min(4, os.cpu_count() or 1)
+MAX_BATCH_FILES = 500
+# 一括編集のZIPは公開ディレクトリ（static）の外に置き、一定時間で削除する
+BATCH_FOLDER = 'batch_exports'
+BATCH_ZIP_TTL = 60 * 60  # 1時間
+os.makedirs(BATCH_FOLDER, exist_ok=True)
+batch_executor = None
+batch_executor_lock = threading.Lock()
+
+def get_batch_executor():
+    global batch_executor
+    with batch_executor_lock:
+        if batch_executor is None:
+            batch_executor = ProcessPoolExecutor(max_workers=BATCH_WORKERS)
+            atexit.register(batch_executor.shutdown)
+        return batch_executor
+
+def sweep_batch_zips(now=None):
+    """有効期限（BATCH_ZIP_TTL）を過ぎた一括編集のZIPを削除する"""
+    now = time.time() if now is None else now
+    for name in os.listdir(BATCH_FOLDER):
+        path = os.path.join(BATCH_FOLDER, name)
+        try:
+            if now - os.path.getmtime(path) > BATCH_ZIP_TTL:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -46,11 +86,18 @@ def upload_file():
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
         file.save(file_path)
         
+        # プレビュー用の縮小プロキシを作成（編集中はこちらだけを処理する）
+        editor.create_proxy(unique_filename)
+        width, height = editor.original_size(unique_filename)
+        
         return jsonify({
             'success': True,
             'filename': unique_filename,
             'original_name': original_filename,
-            'url': f'/static/uploads/{unique_filename}'
+            'url': f'/static/uploads/{editor.proxy_filename(unique_filename)}',
+            'original_url': f'/static/uploads/{unique_filename}',
+            'width': width,
+            'height': height
         })
     
     return jsonify({'error': '対応していないファイル形式です'}), 400
@@ -59,7 +106,7 @@ def upload_file():
 def edit_image():
     try:
         data = request.get_json()
-        filename = data.get('filename')
+        filename = secure_filename(data.get('filename') or '')
         operation = data.get('operation')
         
         if not filename or not operation:
@@ -70,46 +117,158 @@ def edit_image():
         if not os.path.exists(original_path):
             return jsonify({'error': 'ファイルが見つかりません'}), 404
         
-        # 画像を開く
-        with Image.open(original_path) as img:
-            # 操作に応じて処理
-            if operation == 'rotate_right':
-                edited_img = img.rotate(-90, expand=True)
-            elif operation == 'rotate_left':
-                edited_img = img.rotate(90, expand=True)
-            elif operation == 'reset':
-                edited_img = img.copy()
-            else:
-                return jsonify({'error': '不正な操作です'}), 400
-            
-            # 編集済み画像を保存
-            edited_filename = f"edited_{filename}"
-            edited_path = os.path.join(app.config['UPLOAD_FOLDER'], edited_filename)
-            
-            # 元の形式を保持して保存
-            if img.format:
-                edited_img.save(edited_path, format=img.format, quality=95)
-            else:
-                # 形式が不明な場合はJPEGで保存
-                edited_img.save(edited_path, format='JPEG', quality=95)
-            
-            return jsonify({
-                'success': True,
-                'edited_filename': edited_filename,
-                'edited_url': f'/static/uploads/{edited_filename}',
-                'width': edited_img.width,
-                'height': edited_img.height
-            })
+        # 操作を記録（元画像は読み直さない）
+        try:
+            editor.push(filename, operation)
+        except ValueError:
+            return jsonify({'error': '不正な操作です'}), 400
+        
+        # 操作リストをまとめた状態をプロキシに適用してプレビューを描画（同じ状態の描画結果は再利用）
+        result = editor.preview(filename)
+        
+        response = {
+            'success': True,
+            'edited_filename': result['filename'],
+            'edited_url': f"/static/uploads/{result['filename']}",
+            'width': result['width'],
+            'height': result['height'],
+            'rotation': result['rotation'],
+            'operations': result['operations'],
+            'cached': result['cached'],
+            # 描画方式（jpegtran / exif / pillow）と描画時間
+            'method': result['method'],
+            'render_ms': result['render_ms']
+        }
+        # 再エンコードと比べて短縮できた時間（同じ形式の実測値がある場合のみ）
+        for key in ('estimated_reencode_ms', 'time_saved_ms'):
+            if key in result:
+                response[key] = result[key]
+        return jsonify(response)
             
     except Exception as e:
         print(f"編集エラー: {e}")
         return jsonify({'error': '画像の編集に失敗しました'}), 500
 
+@app.route('/export/<filename>')
+def export_image(filename):
+    try:
+        filename = secure_filename(filename)
+        if not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
+            return jsonify({'error': 'ファイルが見つかりません'}), 404
+        
+        # 記録済みの操作を元画像にまとめて1回だけ適用してダウンロード
+        result = editor.export(filename)
+        edited_path = os.path.join(app.config['UPLOAD_FOLDER'], result['filename'])
+        download_name = f"edited_{filename}" if result['rotation'] else filename
+        return send_file(edited_path, as_attachment=True, download_name=download_name)
+        
+    except Exception as e:
+        print(f"エクスポートエラー: {e}")
+        return jsonify({'error': 'エクスポートに失敗しました'}), 500
+
+def is_string_list(value):
+    return isinstance(value, list) and bool(value) and all(isinstance(v, str) for v in value)
+
+@app.route('/edit/batch', methods=['POST'])
+def edit_batch():
+    data = request.get_json(silent=True) or {}
+    filenames = data.get('filenames')
+    operations = data.get('operations')
+    make_zip = data.get('zip', True)
+    
+    # 文字列を渡されると1文字ずつ処理してしまうため、文字列のリストだけを受け付ける
+    if not is_string_list(filenames) or not is_string_list(operations):
+        return jsonify({'error': 'filenames と operations は文字列のリストで指定してください'}), 400
+    filenames = [secure_filename(f) for f in filenames]
+    if len(filenames) > MAX_BATCH_FILES:
+        return jsonify({'error': f'一度に処理できるのは{MAX_BATCH_FILES}件までです'}), 400
+    if any(op not in SUPPORTED_OPERATIONS for op in operations):
+        return jsonify({'error': '不正な操作です'}), 400
+    missing = [f for f in filenames
+               if not f or not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], f))]
+    if missing:
+        return jsonify({'error': 'ファイルが見つかりません', 'missing': missing}), 404
+    
+    batch_id = uuid.uuid4().hex
+    
+    def generate():
+        # ワーカープロセスで並列に書き出し、1件終わるごとに進捗を1行のJSONで送る
+        futures = {
+            get_batch_executor().submit(batch_export, app.config['UPLOAD_FOLDER'], f, operations): f
+            for f in dict.fromkeys(filenames)
+        }
+        manifest = []
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                filename = futures[future]
+                try:
+                    result = future.result()
+                    item = {
+                        'filename': filename,
+                        'success': True,
+                        'edited_filename': result['filename'],
+                        'edited_url': f"/static/uploads/{result['filename']}",
+                        'width': result['width'],
+                        'height': result['height'],
+                        'method': result['method'],
+                        'render_ms': result['render_ms']
+                    }
+                except Exception as e:
+                    print(f"一括編集エラー: {filename}: {e}")
+                    item = {'filename': filename, 'success': False, 'error': '画像の編集に失敗しました'}
+                manifest.append(item)
+                yield json.dumps({'type': 'progress', 'done': done, 'total': len(futures),
+                                  **item}, ensure_ascii=False) + '\n'
+        finally:
+            # クライアントが切断した場合は未着手のジョブを取り消す
+            for future in futures:
+                future.cancel()
+        
+        zip_url = None
+        succeeded = [item for item in manifest if item['success']]
+        if make_zip and succeeded:
+            # 画像は圧縮済みのため無圧縮（ZIP_STORED）でまとめる
+            sweep_batch_zips()
+            zip_path = os.path.join(BATCH_FOLDER, f'batch_{batch_id}.zip')
+            tmp_path = f'{zip_path}.tmp'
+            try:
+                with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED) as zf:
+                    for item in succeeded:
+                        zf.write(os.path.join(app.config['UPLOAD_FOLDER'], item['edited_filename']),
+                                 arcname=item['edited_filename'])
+                os.replace(tmp_path, zip_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            zip_url = url_for('download_batch', batch_id=batch_id)
+        
+        yield json.dumps({
+            'type': 'complete',
+            'batch_id': batch_id,
+            'total': len(manifest),
+            'succeeded': len(succeeded),
+            'failed': len(manifest) - len(succeeded),
+            'zip_url': zip_url,
+            'manifest': manifest
+        }, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/edit/batch/<batch_id>.zip')
+def download_batch(batch_id):
+    """一括編集のZIPをダウンロード（作成からBATCH_ZIP_TTL秒まで）"""
+    if not re.fullmatch(r'[0-9a-f]{32}', batch_id):
+        return jsonify({'error': 'ファイルが見つかりません'}), 404
+    zip_path = os.path.join(BATCH_FOLDER, f'batch_{batch_id}.zip')
+    if not os.path.exists(zip_path) or time.time() - os.path.getmtime(zip_path) > BATCH_ZIP_TTL:
+        return jsonify({'error': 'ファイルが見つからないか、有効期限が切れています'}), 404
+    return send_file(os.path.abspath(zip_path), as_attachment=True, download_name=f'batch_{batch_id}.zip')
+
 @app.route('/reset', methods=['POST'])
 def reset_image():
     try:
         data = request.get_json()
-        original_filename = data.get('original_filename')
+        original_filename = secure_filename(data.get('original_filename') or '')
         
         if not original_filename:
             return jsonify({'error': 'ファイル名が指定されていません'}), 400
@@ -118,10 +277,20 @@ def reset_image():
         if not os.path.exists(original_path):
             return jsonify({'error': '元ファイルが見つかりません'}), 404
         
+        # 編集セッションの操作リストを破棄
+        editor.reset(original_filename)
+        
+        width, height = editor.original_size(original_filename)
+        preview_filename = editor.proxy_filename(original_filename)
+        if not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], preview_filename)):
+            preview_filename = original_filename
+        
         return jsonify({
             'success': True,
-            'reset_url': f'/static/uploads/{original_filename}',
-            'filename': original_filename
+            'reset_url': f'/static/uploads/{preview_filename}',
+            'filename': original_filename,
+            'width': width,
+            'height': height
         })
         
     except Exception as e:
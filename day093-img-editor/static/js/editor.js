@@ -87,7 +87,8 @@ async function uploadFile(file) {
         
         if (result.success) {
             currentFile = result;
-            displayImage(result.url, result.original_name);
+            // プレビューは縮小プロキシ、サイズ表示は元画像
+            displayImage(result.url, result.original_name, result.width, result.height);
             showEditor();
         } else {
             alert(result.error || 'アップロードに失敗しました。');
@@ -100,14 +101,12 @@ async function uploadFile(file) {
     }
 }
 
-function displayImage(imageUrl, originalName) {
-    previewImage.src = imageUrl;
-    previewImage.onload = function() {
-        updateImageInfo(originalName, previewImage.naturalWidth, previewImage.naturalHeight);
-    };
-    
+function displayImage(imageUrl, originalName, width, height) {
     // 編集履歴をクリア
     editHistory = [];
+    
+    previewImage.src = imageUrl;
+    updateImageInfo(originalName, width, height);
 }
 
 function updateImageInfo(originalName, width, height) {
@@ -172,7 +171,8 @@ async function rotateImage(degrees) {
                 'Content-Type': 'application/json'
             },
             body: JSON.stringify({
-                filename: getCurrentFilename(),
+                // 操作はサーバー側の編集セッションに積まれるため、常に元画像を指定
+                filename: currentFile.filename,
                 operation: operation
             })
         });
@@ -187,7 +187,7 @@ async function rotateImage(degrees) {
                 url: result.edited_url
             });
             
-            // プレビューを更新
+            // プレビューを更新（同じ回転状態に戻った場合はキャッシュ済みの描画結果）
             updatePreview(result.edited_url, result.edited_filename);
             updateImageInfo(currentFile.original_name, result.width, result.height);
             
@@ -238,11 +238,7 @@ async function resetImage() {
             updatePreview(result.reset_url, result.filename);
             
             // 元画像の情報で更新
-            const img = new Image();
-            img.onload = function() {
-                updateImageInfo(currentFile.original_name, img.width, img.height);
-            };
-            img.src = result.reset_url;
+            updateImageInfo(currentFile.original_name, result.width, result.height);
             
             console.log('画像をリセットしました');
         } else {
@@ -264,17 +260,11 @@ function downloadImage() {
         return;
     }
     
-    // 編集済みファイルがある場合は最新の編集版をダウンロード
-    let downloadUrl, downloadName;
-    
-    if (editHistory.length > 0) {
-        const latestEdit = editHistory[editHistory.length - 1];
-        downloadUrl = latestEdit.url;
-        downloadName = `edited_${currentFile.original_name}`;
-    } else {
-        downloadUrl = currentFile.url;
-        downloadName = currentFile.original_name;
-    }
+    // サーバー側で現在の編集状態を書き出してダウンロード
+    const downloadUrl = `/export/${currentFile.filename}`;
+    const downloadName = editHistory.length > 0
+        ? `edited_${currentFile.original_name}`
+        : currentFile.original_name;
     
     const link = document.createElement('a');
     link.href = downloadUrl;
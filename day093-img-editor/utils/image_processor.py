@@ -0,0 +1,370 @@
+# utils/image_processor.py
+import io
+import os
+import time
+import tempfile
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageOps
+from utils.jpeg_lossless import is_jpeg, lossless_rotate
+
+# 操作名 -> 時計回りの回転角度
+ROTATIONS = {
+    'rotate_right': 90,
+    'rotate_left': -90,
+    'rotate_180': 180,
+}
+
+# 時計回りの回転角度 -> Pillowのtranspose（rotate()より高速で画素の補間もない）
+TRANSPOSES = {
+    90: Image.Transpose.ROTATE_270,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_90,
+}
+
+SUPPORTED_OPERATIONS = set(ROTATIONS) | {'reset'}
+
+
+def collapse_operations(operations):
+    """操作リストを1回分の回転角度（0/90/180/270）にまとめる
+
+    回転は足し算で合成できるため、右回転4回は0度（何もしない）、
+    右回転2回は180度の1回に置き換えられる。resetはそれまでの操作を打ち消す。
+    """
+    degrees = 0
+    for operation in operations:
+        if operation == 'reset':
+            degrees = 0
+        else:
+            degrees += ROTATIONS[operation]
+    return degrees % 360
+
+
+def apply_rotation(img, degrees):
+    """時計回りにdegrees度回転した画像を返す（0度の場合は元の画像）"""
+    if degrees == 0:
+        return img
+    return img.transpose(TRANSPOSES[degrees])
+
+
+def rotated_size(width, height, degrees):
+    """回転後の幅・高さ（画像をデコードせずに計算）"""
+    if degrees in (90, 270):
+        return height, width
+    return width, height
+
+
+def display_size(path):
+    """EXIFのOrientationを考慮した表示上の幅・高さ（ヘッダーのみ読み込み）"""
+    with Image.open(path) as img:
+        width, height = img.size
+        if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+            return height, width
+    return width, height
+
+
+def create_proxy(src_path, dst_path, max_size, quality=85):
+    """プレビュー用に縮小した画像（プロキシ）を作成する
+
+    JPEGはdraft()で縮小デコードするため、元画像の全画素は展開しない。
+    EXIFのOrientationは画素に反映してから保存するので、プロキシは常に表示どおりの向きになる。
+    """
+    with Image.open(src_path) as img:
+        image_format = img.format
+        if image_format == 'JPEG':
+            img.draft('RGB', max_size)
+        proxy = ImageOps.exif_transpose(img)
+        proxy.thumbnail(max_size, Image.Resampling.LANCZOS)
+    save_image(proxy, dst_path, image_format, quality)
+    return proxy.size
+
+
+def save_image(img, path, image_format, quality=95):
+    """元の形式を保持して保存（形式が不明な場合はJPEG）"""
+    image_format = image_format or 'JPEG'
+    if image_format == 'JPEG' and img.mode not in ('RGB', 'L', 'CMYK'):
+        img = img.convert('RGB')
+    img.save(path, format=image_format, quality=quality)
+
+
+class DecodedImageCache:
+    """デコード済み画像をリクエストをまたいで保持するLRUキャッシュ
+
+    画素データの合計バイト数がmax_bytesを超えたら、最後に使われたのが古い順に破棄する。
+    キーはパスと更新時刻なので、ファイルが置き換えられたら自動的に読み直す。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()  # (path, mtime) -> (画像, 形式, バイト数)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        """(デコード済み画像, 元の形式) を返す。返した画像は変更しないこと"""
+        key = (path, os.path.getmtime(path))
+        with self._lock:
+            entry = self._images.get(key)
+            if entry:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return entry[0], entry[1]
+            self.misses += 1
+
+        with Image.open(path) as img:
+            image_format = img.format
+            # 編集操作は表示どおりの向きを基準にするため、EXIFのOrientationを画素に反映
+            decoded = ImageOps.exif_transpose(img)
+        size = len(decoded.mode) * decoded.width * decoded.height
+
+        with self._lock:
+            # 同じパスの古い版を破棄
+            for old_key in [k for k in self._images if k[0] == path]:
+                self._total_bytes -= self._images.pop(old_key)[2]
+            self._images[key] = (decoded, image_format, size)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes and len(self._images) > 1:
+                _, (_, _, old_size) = self._images.popitem(last=False)
+                self._total_bytes -= old_size
+        return decoded, image_format
+
+    def discard(self, path):
+        with self._lock:
+            for key in [k for k in self._images if k[0] == path]:
+                self._total_bytes -= self._images.pop(key)[2]
+
+    def stats(self):
+        with self._lock:
+            return {'images': len(self._images), 'bytes': self._total_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+class ImageEditor:
+    """画像ごとの編集セッション（操作リスト）を管理し、必要な時だけ描画する
+
+    - /edit は操作を記録し、アップロード時に作った縮小プロキシにだけ適用してプレビューを返す
+    - /export で初めて元画像に操作をまとめて1回だけ適用する
+    - 描画は操作リストをまとめた結果（回転角度）ごとに1回だけ行い、ファイルとして再利用する
+    - 画像のデコード結果はDecodedImageCacheで共有する
+    - 編集セッションは最後に使われた順に最大max_sessions件まで保持する（古いものから破棄）
+    - JPEGの回転はデコードせずにjpegtran/EXIFで行い（劣化なし）、それ以外はPillowで処理する
+    """
+
+    # 再エンコード時間の推定値を更新する際の重み（指数移動平均）
+    TIMING_WEIGHT = 0.3
+
+    def __init__(self, upload_folder, max_cache_bytes=256 * 1024 * 1024, quality=95,
+                 proxy_size=(1280, 1280), calibrate=True, max_sessions=10000):
+        self.upload_folder = upload_folder
+        self.quality = quality
+        self.proxy_size = proxy_size
+        self.decoded_cache = DecodedImageCache(max_cache_bytes)
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # ファイル名 -> 操作リスト（最後に使われた順）
+        self._lock = threading.Lock()
+        # 画像形式 -> Pillowでのデコード〜回転〜エンコードにかかる時間（1メガピクセルあたりのミリ秒）
+        self.reencode_ms_per_mp = {}
+        # 実測値がない形式を、バックグラウンドで1度だけ計測するか（バッチのワーカーでは計測しない）
+        self.calibrate = calibrate
+        self._calibrating = set()
+
+    def original_path(self, filename):
+        return os.path.join(self.upload_folder, filename)
+
+    def proxy_filename(self, filename):
+        return f'proxy_{filename}'
+
+    def create_proxy(self, filename):
+        """アップロード直後に呼び出し、プレビュー用の縮小プロキシを作成する"""
+        return create_proxy(self.original_path(filename),
+                            self.original_path(self.proxy_filename(filename)), self.proxy_size)
+
+    def original_size(self, filename, degrees=0):
+        """元画像に回転を適用した場合の幅・高さ（ヘッダーのみ読み込み）"""
+        return rotated_size(*display_size(self.original_path(filename)), degrees)
+
+    def operations(self, filename):
+        with self._lock:
+            if filename in self._sessions:
+                self._sessions.move_to_end(filename)
+            return list(self._sessions.get(filename, []))
+
+    def push(self, filename, operation):
+        """操作を記録して、記録後の操作リストを返す"""
+        if operation not in SUPPORTED_OPERATIONS:
+            raise ValueError(f'不正な操作です: {operation}')
+        with self._lock:
+            operations = self._sessions.setdefault(filename, [])
+            self._sessions.move_to_end(filename)
+            if operation == 'reset':
+                operations.clear()
+            else:
+                operations.append(operation)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return list(operations)
+
+    def reset(self, filename):
+        with self._lock:
+            self._sessions.pop(filename, None)
+
+    def rendered_filename(self, filename, degrees):
+        """回転角度ごとの描画結果のファイル名（0度は元画像そのもの）"""
+        if degrees == 0:
+            return filename
+        return f'edited_r{degrees}_{filename}'
+
+    def preview(self, filename):
+        """現在の編集状態をプロキシに適用したプレビューを返す
+
+        プロキシがない場合（旧バージョンでアップロードされた画像）は元画像で描画する。
+        幅・高さは書き出し時（元画像）のサイズを返す。
+        """
+        operations = self.operations(filename)
+        degrees = collapse_operations(operations)
+        source = self.proxy_filename(filename)
+        if not os.path.exists(self.original_path(source)):
+            source = filename
+
+        result = self._render(source, degrees)
+        result['width'], result['height'] = self.original_size(filename, degrees)
+        result['operations'] = operations
+        return result
+
+    def export(self, filename):
+        """記録済みの操作をまとめて元画像に1回だけ適用し、描画結果を返す"""
+        operations = self.operations(filename)
+        result = self._render(filename, collapse_operations(operations))
+        result['operations'] = operations
+        return result
+
+    def _render(self, source_filename, degrees):
+        """source_filenameをdegrees度回転した描画結果を作成する
+
+        同じ状態の描画結果が既にあればエンコードせずに再利用する。
+        """
+        rendered = self.rendered_filename(source_filename, degrees)
+        rendered_path = os.path.join(self.upload_folder, rendered)
+
+        source_path = self.original_path(source_filename)
+        method = None
+        render_ms = 0.0
+        estimated_ms = None
+
+        cached = os.path.exists(rendered_path)
+        if not cached:
+            # 同時リクエスト（別プロセスを含む）で書きかけのファイルを返さないよう、
+            # 一意な一時ファイルに書き出してから置き換える。失敗した場合は一時ファイルを削除する
+            fd, tmp_path = tempfile.mkstemp(dir=self.upload_folder, suffix='.tmp')
+            os.close(fd)
+            try:
+                start = time.perf_counter()
+                if is_jpeg(source_path):
+                    method = lossless_rotate(source_path, tmp_path, degrees)
+                if method:
+                    render_ms = (time.perf_counter() - start) * 1000
+                    estimated_ms = self.estimate_reencode_ms(source_path)
+                    if estimated_ms is None and self.calibrate:
+                        self._start_calibration(source_path)
+                else:
+                    method = 'pillow'
+                    misses = self.decoded_cache.misses
+                    img, image_format = self.decoded_cache.get(source_path)
+                    edited = apply_rotation(img, degrees)
+                    save_image(edited, tmp_path, image_format, self.quality)
+                    render_ms = (time.perf_counter() - start) * 1000
+                    if self.decoded_cache.misses != misses:
+                        # ディスクからデコードした場合だけ再エンコード時間の実測値として記録
+                        self._record_reencode(image_format, render_ms, img.width * img.height)
+                os.replace(tmp_path, rendered_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        width, height = display_size(rendered_path)
+
+        result = {
+            'filename': rendered,
+            'width': width,
+            'height': height,
+            'rotation': degrees,
+            'cached': cached,
+            'method': method,
+            'render_ms': round(render_ms, 2),
+        }
+        if estimated_ms is not None:
+            result['estimated_reencode_ms'] = round(estimated_ms, 2)
+            result['time_saved_ms'] = round(estimated_ms - render_ms, 2)
+        return result
+
+    def _record_reencode(self, image_format, elapsed_ms, pixels):
+        ms_per_mp = elapsed_ms / max(pixels / 1_000_000, 0.001)
+        with self._lock:
+            previous = self.reencode_ms_per_mp.get(image_format)
+            if previous is None:
+                self.reencode_ms_per_mp[image_format] = ms_per_mp
+            else:
+                self.reencode_ms_per_mp[image_format] = previous + self.TIMING_WEIGHT * (ms_per_mp - previous)
+
+    def estimate_reencode_ms(self, path):
+        """Pillowで同じ画像を処理した場合の時間を推定する
+
+        同じ形式の画像をPillowで処理した時の実測値から求める（形式ごとに別の推定値を使う）。
+        その形式の実測値がまだない場合はNoneを返す。
+        """
+        with Image.open(path) as img:
+            image_format = img.format
+            pixels = img.width * img.height
+        with self._lock:
+            ms_per_mp = self.reencode_ms_per_mp.get(image_format)
+        if ms_per_mp is None:
+            return None
+        return ms_per_mp * pixels / 1_000_000
+
+    def _start_calibration(self, path):
+        """実測値のない形式の再エンコード時間を、リクエストとは別のスレッドで1度だけ計測する"""
+        with Image.open(path) as img:
+            image_format = img.format
+        with self._lock:
+            if image_format in self._calibrating:
+                return
+            self._calibrating.add(image_format)
+        threading.Thread(target=self._calibrate, args=(path, image_format),
+                         name=f'reencode-calibration-{image_format}', daemon=True).start()
+
+    def _calibrate(self, path, image_format):
+        # 描画時と同じくデコード〜回転〜エンコードの時間を測る（結果はメモリに書き出して捨てる）
+        try:
+            start = time.perf_counter()
+            with Image.open(path) as img:
+                img = ImageOps.exif_transpose(img)
+                edited = apply_rotation(img, 90)
+                save_image(edited, io.BytesIO(), image_format, self.quality)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        except (OSError, ValueError) as e:
+            print(f"再エンコード時間の計測に失敗: {e}")
+            with self._lock:
+                self._calibrating.discard(image_format)
+            return
+        self._record_reencode(image_format, elapsed_ms, img.width * img.height)
+
+
+# バッチ処理のワーカープロセスごとに1つだけ作るエディタ（デコードキャッシュを再利用）
+_worker_editor = None
+
+
+def batch_export(upload_folder, filename, operations, max_cache_bytes=64 * 1024 * 1024):
+    """ワーカープロセスで実行: 操作リストをまとめて元画像に適用して書き出す
+
+    ProcessPoolExecutorから呼ばれるためモジュール直下に定義する。
+    編集セッションは使わず、引数の操作リストだけで描画する。
+    再エンコード時間の計測（calibrate）は行わないため、ワーカーごとに余分な再エンコードは発生しない。
+    """
+    global _worker_editor
+    if _worker_editor is None or _worker_editor.upload_folder != upload_folder:
+        _worker_editor = ImageEditor(upload_folder, max_cache_bytes=max_cache_bytes, calibrate=False)
+    result = _worker_editor._render(filename, collapse_operations(operations))
+    result['source'] = filename
+    return result
@@ -0,0 +1,134 @@
+# utils/jpeg_lossless.py
+import shutil
+import struct
+import subprocess
+
+ORIENTATION_TAG = 0x0112
+
+# EXIF Orientation <-> 表示時に適用される時計回りの回転角度（反転を含まないものだけ）
+ORIENTATION_TO_DEGREES = {1: 0, 6: 90, 3: 180, 8: 270}
+DEGREES_TO_ORIENTATION = {v: k for k, v in ORIENTATION_TO_DEGREES.items()}
+
+JPEGTRAN = shutil.which('jpegtran')
+
+
+def is_jpeg(path):
+    """先頭のSOIマーカーでJPEGかどうかを判定（拡張子は信用しない）"""
+    with open(path, 'rb') as f:
+        return f.read(2) == b'\xff\xd8'
+
+
+def rotate_with_jpegtran(src_path, dst_path, degrees):
+    """jpegtranでDCT係数を並べ替えて回転する（再量子化なし）
+
+    -perfect を付けるため、幅・高さがMCU境界に揃っていない画像は失敗してFalseを返す。
+    """
+    if not JPEGTRAN:
+        return False
+    result = subprocess.run(
+        [JPEGTRAN, '-copy', 'all', '-perfect', '-rotate', str(degrees),
+         '-outfile', dst_path, src_path],
+        capture_output=True, timeout=60
+    )
+    return result.returncode == 0
+
+
+def _iter_segments(data):
+    """SOSまでのマーカーセグメントを (マーカー, 開始位置, 全体長) で返す"""
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        if marker == 0xDA:  # SOS以降は画像データ
+            return
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        yield marker, pos, length + 2
+        pos += length + 2
+
+
+def _find_orientation(data):
+    """EXIF中のOrientationの値の位置を返す
+
+    Returns:
+        tuple: (値のバイト位置, バイト順, 現在の値)。Exifはあるがタグがない場合は(None, None, None)
+        None: Exifセグメント自体がない場合
+    """
+    for marker, start, _ in _iter_segments(data):
+        if marker != 0xE1 or data[start + 4:start + 10] != b'Exif\x00\x00':
+            continue
+        tiff = start + 10
+        endian = '<' if data[tiff:tiff + 2] == b'II' else '>'
+        ifd = tiff + struct.unpack(endian + 'I', data[tiff + 4:tiff + 8])[0]
+        count = struct.unpack(endian + 'H', data[ifd:ifd + 2])[0]
+        for i in range(count):
+            entry = ifd + 2 + i * 12
+            tag, type_, _ = struct.unpack(endian + 'HHI', data[entry:entry + 8])
+            if tag == ORIENTATION_TAG and type_ == 3:  # SHORT
+                value_pos = entry + 8
+                value = struct.unpack(endian + 'H', data[value_pos:value_pos + 2])[0]
+                return value_pos, endian, value
+        return None, None, None
+    return None
+
+
+def _orientation_segment(orientation):
+    """Orientationタグだけを持つ最小のAPP1(Exif)セグメント"""
+    tiff = b'MM\x00\x2a' + struct.pack('>I', 8)
+    ifd = struct.pack('>H', 1) + struct.pack('>HHIHH', ORIENTATION_TAG, 3, 1, orientation, 0)
+    ifd += struct.pack('>I', 0)
+    payload = b'Exif\x00\x00' + tiff + ifd
+    return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+
+def rotate_with_exif(src_path, dst_path, degrees):
+    """EXIFのOrientationだけを書き換えて回転する（画像データは1バイトも変更しない）
+
+    元のOrientationが反転を含む場合や、Exifに後からタグを追加する必要がある場合は
+    オフセットの書き換えが必要になるためFalseを返す。
+    """
+    with open(src_path, 'rb') as f:
+        data = bytearray(f.read())
+
+    found = _find_orientation(data)
+    if found is None:
+        # Exifがない: APP0(JFIF)の直後、なければSOIの直後に追加
+        insert_at = 2
+        for marker, start, length in _iter_segments(data):
+            if marker == 0xE0:
+                insert_at = start + length
+            break
+        data[insert_at:insert_at] = _orientation_segment(DEGREES_TO_ORIENTATION[degrees])
+    else:
+        value_pos, endian, current = found
+        if value_pos is None or current not in ORIENTATION_TO_DEGREES:
+            return False
+        new_degrees = (ORIENTATION_TO_DEGREES[current] + degrees) % 360
+        data[value_pos:value_pos + 2] = struct.pack(endian + 'H', DEGREES_TO_ORIENTATION[new_degrees])
+
+    with open(dst_path, 'wb') as f:
+        f.write(data)
+    return True
+
+
+def lossless_rotate(src_path, dst_path, degrees):
+    """JPEGを再エンコードせずに回転する
+
+    jpegtranがあればDCTレベルで回転し、なければEXIFのOrientationを書き換える。
+
+    Returns:
+        str: 使用した方式（'jpegtran' / 'exif'）。どちらも使えない場合None
+    """
+    try:
+        with open(src_path, 'rb') as f:
+            found = _find_orientation(f.read())
+        if found is not None and found[2] not in (None, *ORIENTATION_TO_DEGREES):
+            # 反転を含むOrientationは回転と入れ替えられないため再エンコードに任せる
+            return None
+
+        if rotate_with_jpegtran(src_path, dst_path, degrees):
+            return 'jpegtran'
+        if rotate_with_exif(src_path, dst_path, degrees):
+            return 'exif'
+    except (struct.error, IndexError):
+        # 途中で切れた・壊れたExifなどは解析できないため再エンコードに任せる
+        return None
+    return None
@@ -1,6 +1,9 @@
 from flask import Flask, render_template, request, jsonify
 from utils.weather_api import WeatherAPI, JAPANESE_CITIES
+from utils.weather_cache import WeatherCache
+from concurrent.futures import ThreadPoolExecutor
 import os
+import time
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key')
@@ -8,6 +11,33 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key')
 # WeatherAPI インスタンス
 weather_api = WeatherAPI()
 
+# 天気データのキャッシュ（同じ都市へのリクエストで毎回APIを呼ばない）
+#   WEATHER_CACHE_TTL: この秒数まではキャッシュをそのまま返す
+#   WEATHER_CACHE_STALE_TTL: TTL切れ後この秒数までは古い値を返しつつ裏で再取得する
+weather_cache = WeatherCache(
+    ttl=float(os.getenv('WEATHER_CACHE_TTL', 600)),
+    stale_ttl=float(os.getenv('WEATHER_CACHE_STALE_TTL', 3600)),
+)
+
+# 複数都市の一括取得用のスレッドプール（待ち時間はほぼAPIの応答待ちのためスレッドで並行に取得する）
+BULK_WORKERS = int(os.getenv('WEATHER_BULK_WORKERS', 10))
+MAX_BULK_CITIES = 20
+bulk_executor = ThreadPoolExecutor(max_workers=BULK_WORKERS, thread_name_prefix='weather-bulk')
+
+def resolve_city(city):
+    """日本語都市名をAPI用の名前に変換"""
+    return JAPANESE_CITIES.get(city, city)
+
+def fetch_current_weather(city):
+    """現在の天気を取得して整形（キャッシュ経由。失敗した場合はNone）"""
+    raw_data = weather_cache.get('current', city, lambda: weather_api.get_current_weather(city))
+    return weather_api.format_weather_data(raw_data)
+
+def fetch_forecast(city):
+    """日ごとに集計した天気予報を取得（集計結果も元のデータと一緒にキャッシュする。失敗した場合はNone）"""
+    summary = weather_cache.get('forecast', city, lambda: weather_api.get_forecast_summary(city))
+    return summary['daily'] if summary else None
+
 @app.route('/')
 def index():
     """メイン画面"""
@@ -16,39 +46,78 @@ def index():
 @app.route('/api/weather/current')
 def get_current_weather():
     """現在の天気API"""
-    city = request.args.get('city', 'Tokyo,JP')
-    
-    # 日本語都市名の変換
-    if city in JAPANESE_CITIES:
-        city = JAPANESE_CITIES[city]
+    city = resolve_city(request.args.get('city', 'Tokyo,JP'))
     
-    # 天気データ取得
-    raw_data = weather_api.get_current_weather(city)
-    if not raw_data:
+    # 天気データ取得・整形
+    weather_data = fetch_current_weather(city)
+    if not weather_data:
         return jsonify({'error': '天気データの取得に失敗しました'}), 500
     
-    # データ整形
-    weather_data = weather_api.format_weather_data(raw_data)
     return jsonify(weather_data)
 
 @app.route('/api/weather/forecast')
 def get_forecast():
     """天気予報API"""
-    city = request.args.get('city', 'Tokyo,JP')
+    city = resolve_city(request.args.get('city', 'Tokyo,JP'))
     
-    # 日本語都市名の変換
-    if city in JAPANESE_CITIES:
-        city = JAPANESE_CITIES[city]
-    
-    # 予報データ取得
-    raw_data = weather_api.get_forecast(city)
-    if not raw_data:
+    # 予報データ取得・整形
+    forecast_data = fetch_forecast(city)
+    if not forecast_data:
         return jsonify({'error': '予報データの取得に失敗しました'}), 500
     
-    # データ整形
-    forecast_data = weather_api.format_forecast_data(raw_data)
     return jsonify(forecast_data)
 
+@app.route('/api/weather/bulk')
+def get_bulk_weather():
+    """複数都市の天気をまとめて取得するAPI
+
+    Query Parameters:
+        cities: カンマ区切りの都市名（省略時は JAPANESE_CITIES の全都市）
+        include: current / forecast / current,forecast（省略時は current）
+    """
+    names = [name.strip() for name in request.args.get('cities', '').split(',') if name.strip()]
+    names = list(dict.fromkeys(names)) or list(JAPANESE_CITIES)
+    if len(names) > MAX_BULK_CITIES:
+        return jsonify({'error': f'都市は{MAX_BULK_CITIES}件まで指定できます'}), 400
+
+    include = [kind.strip() for kind in request.args.get('include', 'current').split(',') if kind.strip()]
+    fetchers = {'current': fetch_current_weather, 'forecast': fetch_forecast}
+    if not include or any(kind not in fetchers for kind in include):
+        return jsonify({'error': 'include には current / forecast を指定してください'}), 400
+
+    # 都市×種類ごとにスレッドプールへ投入し、すべての完了を待つ（キャッシュは単体のAPIと共有）
+    started = time.perf_counter()
+    futures = {(name, kind): bulk_executor.submit(fetchers[kind], resolve_city(name))
+               for name in names for kind in include}
+
+    results = {}
+    errors = []
+    for (name, kind), future in futures.items():
+        try:
+            data = future.result()
+        except Exception:
+            app.logger.exception('天気データの取得に失敗しました: %s', name)
+            data = None
+        if data is None:
+            errors.append({'city': name, 'type': kind})
+        results.setdefault(name, {})[kind] = data
+
+    return jsonify({
+        'results': results,
+        'errors': errors,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+    })
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    """キャッシュのヒット率などの統計"""
+    return jsonify(weather_cache.stats())
+
+@app.route('/api/upstream/stats')
+def upstream_stats():
+    """OpenWeatherMap APIの呼び出し回数・応答時間・サーキットブレーカーの状態"""
+    return jsonify(weather_api.stats())
+
 # favicon対応
 @app.route('/favicon.ico')
 def favicon():
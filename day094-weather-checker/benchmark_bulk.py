@@ -0,0 +1,63 @@
+# benchmark_bulk.py - 全都市の天気を「1都市ずつ順番に」取得する場合と
+# /api/weather/bulk で一括取得する場合の所要時間を比較する
+#
+#   python benchmark_bulk.py --latency 0.2 --rounds 3
+#
+# ローカルのフェイクサーバー（utils/fake_openweather.py）を起動して使うため、APIキーは不要。
+# 各ラウンドの前にキャッシュを空にするので、毎回すべての都市でAPIを呼び出す。
+import argparse
+import os
+import statistics
+import time
+
+from utils.fake_openweather import FakeOpenWeatherServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='複数都市の天気取得のベンチマーク')
+    parser.add_argument('--latency', type=float, default=0.2, help='フェイクサーバーの応答時間（秒）')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--include', default='current,forecast')
+    args = parser.parse_args()
+
+    server = FakeOpenWeatherServer(latency=args.latency).start()
+    os.environ['OPENWEATHER_BASE_URL'] = server.base_url
+    os.environ.setdefault('OPENWEATHER_API_KEY', 'benchmark')
+
+    # 環境変数を設定してから読み込む（WeatherAPIは読み込み時に作成される）
+    from app import app, weather_cache, JAPANESE_CITIES
+
+    client = app.test_client()
+    kinds = args.include.split(',')
+    print(f'🌤️ {len(JAPANESE_CITIES)}都市 × {kinds} / フェイクサーバーの遅延 {args.latency}秒')
+
+    def sequential():
+        for name in JAPANESE_CITIES:
+            for kind in kinds:
+                response = client.get(f'/api/weather/{kind}', query_string={'city': name})
+                assert response.status_code == 200, response.get_json()
+
+    def bulk():
+        response = client.get('/api/weather/bulk', query_string={'include': args.include})
+        assert response.status_code == 200 and not response.get_json()['errors']
+
+    for label, run in (('順番に取得', sequential), ('一括取得  ', bulk)):
+        times = []
+        for _ in range(args.rounds):
+            weather_cache.invalidate()
+            server.reset()
+            started = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - started)
+        print(f'{label}: 中央値 {statistics.median(times) * 1000:8.1f} ms'
+              f'（APIへのリクエスト {server.stats()["total"]}件/回）')
+
+    # キャッシュが効いている状態（2回目以降の表示）
+    started = time.perf_counter()
+    bulk()
+    print(f'一括取得（キャッシュ済み）: {(time.perf_counter() - started) * 1000:8.1f} ms')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
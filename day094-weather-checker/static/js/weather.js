@@ -137,7 +137,7 @@ function displayForecast(data) {
             <img class="forecast-icon" 
                  src="http://openweathermap.org/img/wn/${forecast.icon}@2x.png" 
                  alt="${forecast.description}">
-            <div class="forecast-temp">${forecast.temperature}°C</div>
+            <div class="forecast-temp">${forecast.temp_max}°C / ${forecast.temp_min}°C</div>
             <div class="forecast-desc">${forecast.description}</div>
         `;
         
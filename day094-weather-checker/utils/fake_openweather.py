@@ -0,0 +1,159 @@
+# utils/fake_openweather.py - 動作確認・負荷試験用のOpenWeatherMap互換サーバー
+#
+#   python utils/fake_openweather.py --port 8099 --latency 0.3
+#   OPENWEATHER_BASE_URL=http://127.0.0.1:8099/data/2.5 OPENWEATHER_API_KEY=dummy python app.py
+#
+# /data/2.5/weather と /data/2.5/forecast に固定の形式のデータを返す。
+# GET /stats で受け付けたリクエスト数を確認できる（POST /stats/reset でリセット）。
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FORECAST_SLOTS = 40      # 3時間ごと×5日分
+FORECAST_INTERVAL = 3 * 60 * 60
+CONDITIONS = [
+    ('晴天', '01d'),
+    ('薄い雲', '02d'),
+    ('曇りがち', '04d'),
+    ('小雨', '10d'),
+]
+
+
+def _city_name(city):
+    return (city or 'Tokyo').split(',')[0]
+
+
+def current_weather(city, now=None):
+    now = int(now or time.time())
+    description, icon = CONDITIONS[now // 600 % len(CONDITIONS)]
+    return {
+        'name': _city_name(city),
+        'sys': {'country': 'JP'},
+        'main': {'temp': 25.4, 'feels_like': 26.1, 'humidity': 60, 'pressure': 1012},
+        'weather': [{'description': description, 'icon': icon}],
+        'wind': {'speed': 3.2, 'deg': 180},
+        'visibility': 10000,
+        'dt': now,
+    }
+
+
+def forecast(city, now=None):
+    start = int(now or time.time()) // FORECAST_INTERVAL * FORECAST_INTERVAL + FORECAST_INTERVAL
+    items = []
+    for i in range(FORECAST_SLOTS):
+        description, icon = CONDITIONS[i // 3 % len(CONDITIONS)]
+        items.append({
+            'dt': start + i * FORECAST_INTERVAL,
+            'main': {'temp': 20 + (i % 8) * 1.5, 'humidity': 50 + i % 30},
+            'weather': [{'description': description, 'icon': icon}],
+        })
+    return {'city': {'name': _city_name(city), 'country': 'JP', 'timezone': 32400}, 'cnt': FORECAST_SLOTS, 'list': items}
+
+
+class FakeOpenWeatherServer(ThreadingHTTPServer):
+    """latency秒待ってから応答するOpenWeatherMap互換サーバー"""
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, fail_rate=0.0):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._failures = 0.0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/data/2.5'
+
+    def count(self, path):
+        with self._lock:
+            self.counts[path] = self.counts.get(path, 0) + 1
+            # fail_rateの割合で500を返す（乱数を使わず一定間隔で失敗させる）
+            self._failures += self.fail_rate
+            if self._failures >= 1:
+                self._failures -= 1
+                return True
+        return False
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, total=sum(self.counts.values()))
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+
+    def start(self):
+        """バックグラウンドのスレッドで起動する（ベンチマーク用）"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-Aliveで接続を使い回せるようにする（Content-Lengthは常に送る）
+    protocol_version = 'HTTP/1.1'
+    # ヘッダーと本文を別々に送るため、Nagleアルゴリズムによる遅延を避ける
+    disable_nagle_algorithm = True
+    ROUTES = {'/data/2.5/weather': current_weather, '/data/2.5/forecast': forecast}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            return self._send(200, self.server.stats())
+        handler = self.ROUTES.get(url.path)
+        if handler is None:
+            return self._send(404, {'cod': '404', 'message': 'not found'})
+
+        failed = self.server.count(url.path)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        params = parse_qs(url.query)
+        if not params.get('appid'):
+            return self._send(401, {'cod': 401, 'message': 'Invalid API key.'})
+        if failed:
+            return self._send(500, {'cod': '500', 'message': 'internal error'})
+        self._send(200, handler(params.get('q', ['Tokyo,JP'])[0]))
+
+    def do_POST(self):
+        if urlparse(self.path).path == '/stats/reset':
+            self.server.reset()
+            return self._send(200, {'ok': True})
+        self._send(404, {'cod': '404', 'message': 'not found'})
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenWeatherMap互換のテスト用サーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.2, help='応答までの待ち時間（秒）')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='500を返す割合（0〜1）')
+    args = parser.parse_args()
+
+    server = FakeOpenWeatherServer((args.host, args.port), args.latency, args.fail_rate)
+    print(f'🌤️ フェイクサーバー起動: {server.base_url} (遅延 {args.latency}秒)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+SECONDS_PER_DAY = 24 * 60 * 60
+DEFAULT_TIMEZONE = 9 * 60 * 60  # レスポンスにタイムゾーンがない場合は日本時間とする
+
+
+def aggregate_daily(data, days=5):
+    """5日間予報（3時間ごと×最大40件）を日ごとに集計する
+
+    現地時刻の日付ごとに、気温の最低・最高・平均、湿度の平均、
+    もっとも多く出現した天気（同数の場合はその日に先に出現したもの）をまとめる。
+    値は最初にnumpyの配列に取り出し、日ごとの集計は配列演算で一度に行う。
+
+    Returns:
+        list: 日ごとの集計（先頭からdays日分）
+    """
+    items = data.get('list') or []
+    if not items:
+        return []
+
+    offset = (data.get('city') or {}).get('timezone', DEFAULT_TIMEZONE)
+    dt = np.array([item['dt'] for item in items], dtype=np.int64)
+    temp = np.array([item['main']['temp'] for item in items], dtype=np.float64)
+    humidity = np.array([item['main'].get('humidity', np.nan) for item in items], dtype=np.float64)
+    weather = [item['weather'][0] for item in items]
+    descriptions = np.array([w['description'] for w in weather])
+
+    order = np.argsort(dt, kind='stable')
+    dt, temp, humidity, descriptions = dt[order], temp[order], humidity[order], descriptions[order]
+    icons = [weather[i]['icon'] for i in order]
+
+    # 現地時刻の日付（エポックからの日数）でグループ分けする
+    day_index = (dt + offset) // SECONDS_PER_DAY
+    day_keys, starts, counts = np.unique(day_index, return_index=True, return_counts=True)
+    groups = np.repeat(np.arange(len(day_keys)), counts)
+
+    temp_min = np.minimum.reduceat(temp, starts)
+    temp_max = np.maximum.reduceat(temp, starts)
+    temp_mean = np.add.reduceat(temp, starts) / counts
+    valid = ~np.isnan(humidity)
+    humidity_count = np.bincount(groups, weights=valid, minlength=len(day_keys))
+    humidity_sum = np.bincount(groups, weights=np.where(valid, humidity, 0), minlength=len(day_keys))
+
+    # 日×天気ごとの出現回数と最初に出現した枠の位置の表を作り、日ごとに
+    # 出現回数が最大の天気を選ぶ（同数の場合はその日に先に出現したもの）
+    labels, codes = np.unique(descriptions, return_inverse=True)
+    positions = np.arange(len(dt))
+    table = np.zeros((len(day_keys), len(labels)), dtype=np.int64)
+    np.add.at(table, (groups, codes), 1)
+    first_slot = np.full(table.shape, len(dt), dtype=np.int64)
+    np.minimum.at(first_slot, (groups, codes), positions)
+    dominant = (table * (len(dt) + 1) - first_slot).argmax(axis=1)
+    icon_slot = first_slot[np.arange(len(day_keys)), dominant]
+
+    forecasts = []
+    for i, day_key in enumerate(day_keys[:days]):
+        icon = icons[icon_slot[i]]
+        # 現地の日付（day_keyは現地時刻での日数なのでUTCとして書式化する）
+        date = datetime.fromtimestamp(int(day_key) * SECONDS_PER_DAY, tz=timezone.utc)
+        forecasts.append({
+            'date': date.strftime('%m/%d'),
+            'day': date.strftime('%a'),
+            'temperature': round(float(temp_mean[i])),
+            'temp_min': round(float(temp_min[i])),
+            'temp_max': round(float(temp_max[i])),
+            'temp_mean': round(float(temp_mean[i]), 1),
+            'humidity': round(float(humidity_sum[i] / humidity_count[i])) if humidity_count[i] else None,
+            'description': str(labels[dominant[i]]),
+            # 日ごとの表示には昼のアイコンを使う
+            'icon': icon[:-1] + 'd' if icon.endswith('n') else icon,
+            'slots': int(counts[i]),
+        })
+    return forecasts
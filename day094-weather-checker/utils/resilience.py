@@ -0,0 +1,111 @@
+import bisect
+import threading
+import time
+
+
+class CircuitBreakerOpen(Exception):
+    """サーキットブレーカーが開いているため呼び出さなかった"""
+
+
+class CircuitBreaker:
+    """連続して失敗した外部APIへの呼び出しを一時的に止める
+
+    - closed: 通常どおり呼び出す。failure_threshold回連続で失敗したらopenにする
+    - open: reset_timeout秒の間は呼び出さずに失敗させる
+    - half_open: reset_timeout秒経過後、1件だけ試しに呼び出し、成功すればclosedに戻す
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """呼び出してよいかを返す（half_openでは試行中の1件だけ許可する）"""
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self._trial = False
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self._trial:
+                self._trial = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self._trial = False
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'consecutive_failures': self.failures,
+                    'rejected': self.rejected}
+
+
+class LatencyHistogram:
+    """応答時間のヒストグラム（Prometheusと同じく各バケットは「この秒数以下」の累積件数）"""
+
+    DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # 最後は上限を超えたもの
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += seconds
+
+    def quantile(self, q, counts=None):
+        """バケットの上限値から分位点を概算する"""
+        counts = counts or self._counts
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound if bound != float('inf') else self.buckets[-1]
+        return self.buckets[-1]
+
+    def stats(self):
+        with self._lock:
+            counts = list(self._counts)
+            total_sum = self._sum
+        total = sum(counts)
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        buckets['+Inf'] = total
+        return {
+            'count': total,
+            'sum': round(total_sum, 6),
+            'avg': round(total_sum / total, 6) if total else None,
+            'p50': self.quantile(0.5, counts),
+            'p95': self.quantile(0.95, counts),
+            'buckets': buckets,
+        }
@@ -1,53 +1,138 @@
 import requests
 import os
+import random
+import threading
+import time
 from datetime import datetime
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from utils.forecast_aggregation import aggregate_daily
+from utils.resilience import CircuitBreaker, LatencyHistogram
 
 load_dotenv()
 
+# リトライする（一時的な障害とみなす）HTTPステータス
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
 class WeatherAPI:
-    def __init__(self):
+    """OpenWeatherMap APIのクライアント
+
+    - requests.Sessionを1つ持ち、接続をプールしてKeep-Aliveで使い回す
+    - すべての呼び出しに(接続, 読み込み)のタイムアウトを付ける
+    - 接続エラー・タイムアウト・429/5xxは、ジッター付きの指数バックオフでリトライする
+    - 失敗が続いた場合はサーキットブレーカーが開き、しばらくAPIを呼ばずに失敗させる
+    - 試行ごとの応答時間をエンドポイント別のヒストグラムに記録する（stats()で参照）
+    """
+
+    def __init__(self, timeout=None, max_retries=None, backoff=0.3, max_backoff=5.0,
+                 pool_size=None, breaker=None):
         self.api_key = os.getenv('OPENWEATHER_API_KEY')
-        self.base_url = "http://api.openweathermap.org/data/2.5"
+        # テスト用のフェイクサーバーを使う場合は OPENWEATHER_BASE_URL で切り替える
+        self.base_url = os.getenv('OPENWEATHER_BASE_URL', "http://api.openweathermap.org/data/2.5")
         
         if not self.api_key:
             raise ValueError("OpenWeatherMap APIキーが設定されていません")
-    
-    def get_current_weather(self, city="Tokyo,JP"):
-        """現在の天気を取得"""
-        url = f"{self.base_url}/weather"
+
+        self.timeout = timeout or (float(os.getenv('OPENWEATHER_CONNECT_TIMEOUT', 3.05)),
+                                   float(os.getenv('OPENWEATHER_READ_TIMEOUT', 10)))
+        self.max_retries = int(os.getenv('OPENWEATHER_RETRIES', 2)) if max_retries is None else max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker(
+            failure_threshold=int(os.getenv('OPENWEATHER_BREAKER_THRESHOLD', 5)),
+            reset_timeout=float(os.getenv('OPENWEATHER_BREAKER_RESET', 30)),
+        )
+        self.pool_size = pool_size or int(os.getenv('OPENWEATHER_POOL_SIZE', 20))
+
+        self.session = requests.Session()
+        # リトライは_request()で行うため、urllib3側のリトライは無効にする
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size,
+                              max_retries=0, pool_block=False)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.latency = {'weather': LatencyHistogram(), 'forecast': LatencyHistogram()}
+        self._lock = threading.Lock()
+        self._counters = {'requests': 0, 'attempts': 0, 'retries': 0, 'failures': 0,
+                          'short_circuited': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _backoff(self, attempt, retry_after=None):
+        """リトライまでの待ち時間（full jitter。Retry-Afterがあればそれに従う）"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _request(self, endpoint, city):
+        """APIを呼び出してJSONを返す（失敗した場合はNone）"""
+        self._count('requests')
+        if not self.breaker.allow():
+            self._count('short_circuited')
+            print(f"API呼び出し停止中（サーキットブレーカー）: {endpoint} {city}")
+            return None
+
+        url = f"{self.base_url}/{endpoint}"
         params = {
             'q': city,
             'appid': self.api_key,
             'units': 'metric',  # 摂氏
             'lang': 'ja'        # 日本語
         }
-        
-        try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            print(f"API呼び出しエラー: {e}")
-            return None
+        histogram = self.latency[endpoint]
+
+        for attempt in range(self.max_retries + 1):
+            self._count('attempts')
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+                histogram.observe(time.perf_counter() - started)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    self.breaker.record_success()
+                    return response.json()
+                retry_after = response.headers.get('Retry-After')
+                error = f"HTTP {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                histogram.observe(time.perf_counter() - started)
+                error = e
+            except requests.RequestException as e:
+                # 401（APIキー不正）や404（都市が見つからない）はリトライしない
+                self.breaker.record_success()
+                print(f"API呼び出しエラー: {e}")
+                return None
+
+            if attempt < self.max_retries:
+                self._count('retries')
+                time.sleep(self._backoff(attempt, retry_after))
+
+        self._count('failures')
+        self.breaker.record_failure()
+        print(f"API呼び出しエラー（{self.max_retries + 1}回失敗）: {error}")
+        return None
+
+    def get_current_weather(self, city="Tokyo,JP"):
+        """現在の天気を取得"""
+        return self._request('weather', city)
     
     def get_forecast(self, city="Tokyo,JP"):
         """5日間の天気予報を取得"""
-        url = f"{self.base_url}/forecast"
-        params = {
-            'q': city,
-            'appid': self.api_key,
-            'units': 'metric',
-            'lang': 'ja'
-        }
-        
-        try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            print(f"予報取得エラー: {e}")
-            return None
+        return self._request('forecast', city)
+
+    def stats(self):
+        """呼び出し回数・サーキットブレーカーの状態・応答時間のヒストグラム"""
+        with self._lock:
+            stats = dict(self._counters)
+        stats['circuit_breaker'] = self.breaker.stats()
+        stats['latency'] = {endpoint: histogram.stats() for endpoint, histogram in self.latency.items()}
+        return stats
     
     def format_weather_data(self, data):
         """天気データを整形"""
@@ -69,22 +154,19 @@ class WeatherAPI:
             'datetime': datetime.now().strftime('%Y年%m月%d日 %H:%M')
         }
     
-    def format_forecast_data(self, data):
-        """予報データを整形"""
+    def format_forecast_data(self, data, days=5):
+        """予報データを日ごとに集計して整形（最低・最高・平均気温、代表の天気）"""
         if not data:
             return None
-            
-        forecasts = []
-        for item in data['list'][:5]:  # 5日分
-            forecasts.append({
-                'date': datetime.fromtimestamp(item['dt']).strftime('%m/%d'),
-                'day': datetime.fromtimestamp(item['dt']).strftime('%a'),
-                'temperature': round(item['main']['temp']),
-                'description': item['weather'][0]['description'],
-                'icon': item['weather'][0]['icon']
-            })
-        
-        return forecasts
+
+        return aggregate_daily(data, days)
+
+    def get_forecast_summary(self, city="Tokyo,JP"):
+        """予報を取得し、元のデータと日ごとの集計をまとめて返す（キャッシュに入れる単位）"""
+        raw_data = self.get_forecast(city)
+        if not raw_data:
+            return None
+        return {'raw': raw_data, 'daily': self.format_forecast_data(raw_data)}
 
 # 日本の主要都市リスト
 JAPANESE_CITIES = {
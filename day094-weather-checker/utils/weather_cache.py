@@ -0,0 +1,119 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _Flight:
+    """実行中の取得処理（同じキーの後続リクエストは結果を待つ）"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+
+
+class WeatherCache:
+    """天気APIのレスポンス用キャッシュ（キー: (エンドポイント, 都市)）
+
+    - ttl秒以内の値はそのまま返す
+    - ttl秒を過ぎてもstale_ttl秒以内なら古い値をすぐに返し、裏で再取得する
+      （stale-while-revalidate）。再取得に失敗した場合も古い値を使い続ける
+    - キャッシュにないキーへの同時リクエストは1回の取得にまとめる（single-flight）
+    - 取得に失敗した結果（None）はキャッシュしない
+    """
+
+    def __init__(self, ttl=600, stale_ttl=3600, max_entries=1000, max_workers=4):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # キー -> (取得時刻, 値)
+        self._flights = {}             # キー -> _Flight
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='weather-refresh')
+        self._counters = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'coalesced': 0,
+                          'refreshes': 0, 'errors': 0}
+
+    def get(self, endpoint, city, loader):
+        """キャッシュから値を返す（なければloader()で取得してキャッシュする）"""
+        key = self._key(endpoint, city)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                fetched_at, value = entry
+                age = now - fetched_at
+                if age <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self._counters['hits'] += 1
+                    return value
+                if age <= self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    self._counters['stale_hits'] += 1
+                    if key not in self._flights:
+                        self._flights[key] = _Flight()
+                        self._counters['refreshes'] += 1
+                        self._executor.submit(self._load, key, loader)
+                    return value
+                del self._entries[key]
+
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._counters['coalesced'] += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                self._counters['misses'] += 1
+                leader = True
+
+        if leader:
+            return self._load(key, loader)
+        flight.event.wait()
+        return flight.value
+
+    def _key(self, endpoint, city):
+        # 'Tokyo,JP' と 'tokyo,jp' は同じ都市として扱う
+        return endpoint, (city or '').strip().lower()
+
+    def _load(self, key, loader):
+        value = None
+        try:
+            value = loader()
+        finally:
+            with self._lock:
+                if value is None:
+                    self._counters['errors'] += 1
+                    # 再取得に失敗した場合は古い値を待っているリクエストに渡す
+                    entry = self._entries.get(key)
+                    if entry is not None:
+                        value = entry[1]
+                else:
+                    self._entries[key] = (time.monotonic(), value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                flight = self._flights.pop(key)
+            flight.value = value
+            flight.event.set()
+        return value
+
+    def invalidate(self, endpoint=None, city=None):
+        """指定したエンドポイント・都市の値を削除する（省略時はすべて）"""
+        city = None if city is None else self._key(endpoint, city)[1]
+        with self._lock:
+            for key in list(self._entries):
+                if endpoint in (None, key[0]) and city in (None, key[1]):
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            stats['in_flight'] = len(self._flights)
+        served = stats['hits'] + stats['stale_hits'] + stats['coalesced']
+        total = served + stats['misses']
+        stats['hit_rate'] = served / total if total else 0.0
+        return stats
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
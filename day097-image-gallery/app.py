@@ -1,9 +1,15 @@
 import os
+import re
 import uuid
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory
-from PIL import Image
+import atexit
+import mimetypes
+from urllib.parse import quote
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, abort
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from image_index import ImageIndex
+from thumbnail_worker import ThumbnailQueue, STATUS_DONE, STATUS_PENDING
+from derivative_cache import DerivativeCache, FORMATS, file_content_hash
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-in-production'
@@ -13,10 +19,26 @@ UPLOAD_FOLDER = 'uploads'
 THUMBNAIL_FOLDER = 'thumbnails'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
+INDEX_DB = 'gallery.db'
+PAGE_SIZE = 40
+THUMBNAIL_WORKERS = None  # Noneの場合はCPUコア数
+PLACEHOLDER_FOLDER = os.path.join('static', 'images')
+PLACEHOLDER_FILE = 'thumbnail_placeholder.svg'
+DERIVATIVE_FOLDER = 'derivatives'
+DERIVATIVE_MAX_BYTES = 512 * 1024 * 1024  # 512MB
+DERIVATIVE_WIDTHS = (150, 300, 600, 1200, 2400)
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60  # 1年
+REVALIDATE_MAX_AGE = 60 * 60  # 1時間（フィンガープリントなしのファイル名）
+# 画像配信をWebサーバーに任せる場合: 'x-sendfile'（Apache等）/ 'x-accel-redirect'（nginx）
+SENDFILE_MODE = os.environ.get('SENDFILE_MODE')
+X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX', '/protected')
+# upload_files()が付与する "_<uuid先頭8桁>.<拡張子>" 形式のファイル名
+FINGERPRINT_PATTERN = re.compile(r'_[0-9a-f]{8}\.[A-Za-z0-9]+$')
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['THUMBNAIL_FOLDER'] = THUMBNAIL_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+app.config['USE_X_SENDFILE'] = SENDFILE_MODE == 'x-sendfile'
 
 def allowed_file(filename):
     """
@@ -36,51 +58,117 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def create_thumbnail(image_path, thumbnail_path, size=(300, 300)):
+def is_fingerprinted(filename):
     """
-    アップロード画像からサムネイル画像を作成する関数
+    ファイル名がUUIDフィンガープリント付きかチェックする関数
     
     Args:
-        image_path (str): 元画像ファイルのパス
-        thumbnail_path (str): サムネイル保存先パス
-        size (tuple): サムネイルサイズ (幅, 高さ)、デフォルト(300, 300)
+        filename (str): チェック対象のファイル名
+    
+    Returns:
+        bool: upload_files()が生成した一意なファイル名の場合True
     
     Note:
-        - Pillowライブラリを使用してリサイズ処理
-        - LANCZOSリサンプリングで高品質な縮小
-        - optimize=True, quality=85でファイルサイズ最適化
-        - アスペクト比を維持してリサイズ
+        - 一意なファイル名は内容が変わらないため、URLごと永続キャッシュできる
+        - 旧バージョンで保存された名前は同名で再アップロードされうるため対象外
+    """
+    return FINGERPRINT_PATTERN.search(filename) is not None
+
+def cache_control(immutable):
+    """
+    Cache-Controlヘッダーの値を返す関数
     
-    Raises:
-        Exception: 画像ファイルの読み込みや保存に失敗した場合
+    Args:
+        immutable (bool): URLと内容が1対1に対応し、永続キャッシュしてよい場合True
+    
+    Returns:
+        str: Cache-Controlヘッダーの値
     """
-    with Image.open(image_path) as image:
-        image.thumbnail(size, Image.Resampling.LANCZOS)
-        image.save(thumbnail_path, optimize=True, quality=85)
+    if immutable:
+        return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return f'public, max-age={REVALIDATE_MAX_AGE}'
 
-def get_image_info(filepath):
+def not_modified(etag, immutable=False):
     """
-    画像ファイルのメタデータ情報を取得する関数
+    ファイルを開かずに304 Not Modifiedのレスポンスを作る関数
     
     Args:
-        filepath (str): 画像ファイルのフルパス
+        etag (str): 強いETagとして返す値
+        immutable (bool): 永続キャッシュしてよい場合True
     
     Returns:
-        dict: 画像情報を含む辞書
-            - size (float): ファイルサイズ（KB単位、小数点以下2桁）
-            - uploaded (str): ファイル更新日時（YYYY-MM-DD HH:MM:SS形式）
+        Response: ETagとCache-Control付きの304レスポンス
+    """
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control(immutable)
+    return response
+
+def send_image(folder, filename, etag=None, immutable=False, mimetype=None):
+    """
+    キャッシュヘッダー付きで画像ファイルを配信する関数
+    
+    Args:
+        folder (str): 配信元フォルダ
+        filename (str): 配信するファイル名
+        etag (str): 強いETagとして使う値（内容ハッシュ等）、省略時はFlaskの既定値
+        immutable (bool): URLと内容が1対1に対応し、永続キャッシュしてよい場合True
+        mimetype (str): Content-Type、省略時は拡張子から推定
+    
+    Returns:
+        Response: 画像ファイルのレスポンス（If-None-Match一致時は304）
     
     Note:
-        - os.stat()でファイルシステム情報を取得
-        - st_sizeをKB単位に変換（1024で割る）
-        - st_mtimeを日時文字列に変換
-        - ギャラリー表示用のメタデータとして使用
+        - immutable=Trueは「public, max-age=1年, immutable」で再検証自体を不要にする
+        - それ以外は短いmax-ageとETagによる条件付きリクエストで再検証
+        - ETag一致時はファイルを開かずに304を返す
+        - SENDFILE_MODEが設定されていれば本体の送信はWebサーバーに任せる
+    """
+    max_age = IMMUTABLE_MAX_AGE if immutable else REVALIDATE_MAX_AGE
+    
+    if etag and etag in request.if_none_match:
+        return not_modified(etag, immutable)
+    if SENDFILE_MODE == 'x-accel-redirect':
+        path = safe_join(folder, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = app.response_class(
+            mimetype=mimetype or mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        # URLと同じくパーセントエンコードする（ファイル名の空白・非ASCII文字に対応）
+        response.headers['X-Accel-Redirect'] = f"{X_ACCEL_PREFIX}/{quote(f'{folder}/{filename}')}"
+    else:
+        response = send_from_directory(folder, filename, mimetype=mimetype,
+                                       etag=etag or True, max_age=max_age)
+    
+    if etag:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control(immutable)
+    return response
+
+def get_content_hash(filename):
+    """
+    インデックスから画像の内容ハッシュを取得する関数
+    
+    Args:
+        filename (str): 画像ファイル名
+    
+    Returns:
+        str | None: 内容ハッシュ、未登録の場合None
     """
-    stat = os.stat(filepath)
-    return {
-        'size': round(stat.st_size / 1024, 2),  # KB
-        'uploaded': datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
-    }
+    image = image_index.get_image(filename)
+    return image['content_hash'] if image else None
+
+# メタデータインデックス（初回起動時のみ既存ファイルを取り込む）
+image_index = ImageIndex(INDEX_DB)
+if image_index.count() == 0:
+    image_index.rebuild_from_directory(UPLOAD_FOLDER, allowed_file)
+
+# サムネイル生成キュー（リクエスト外のワーカープロセスで並列処理）
+thumbnail_queue = ThumbnailQueue(THUMBNAIL_FOLDER, max_workers=THUMBNAIL_WORKERS)
+atexit.register(thumbnail_queue.shutdown)
+
+# サイズ・形式別の派生画像キャッシュ（オンデマンド生成、LRUで容量管理）
+derivative_cache = DerivativeCache(DERIVATIVE_FOLDER, DERIVATIVE_MAX_BYTES, DERIVATIVE_WIDTHS)
 
 @app.route('/')
 def index():
@@ -88,35 +176,26 @@ def index():
     メインページ（ギャラリー表示）のルートハンドラ
     
     機能:
-        - アップロード済み画像の一覧を取得・表示
-        - 画像メタデータ（ファイル名、サイズ、アップロード日時）を収集
-        - 最新アップロード順でソート
+        - アップロード済み画像の一覧を1ページ分取得・表示
+        - 画像メタデータ（ファイル名、サイズ、アップロード日時）をインデックスから取得
+        - 最新アップロード順（実タイムスタンプ）でソート
     
     Returns:
         str: レンダリングされたHTMLテンプレート
     
     Note:
-        - uploadsフォルダ内の画像ファイルをスキャン
-        - allowed_file()で対応ファイルのみフィルタリング
-        - get_image_info()でメタデータ取得
-        - テンプレートにimagesリストを渡して表示
+        - uploadsフォルダは走査せずImageIndexから取得
+        - ?cursor= で次ページを指定するキーセットページネーション
+        - 1リクエストあたりのコストはPAGE_SIZEに比例
+        - サムネイル生成中の画像にはthumbnail_pendingフラグを付与
+        - テンプレートにimagesリストと次ページカーソルを渡して表示
     """
-    # アップロード済み画像一覧取得
-    images = []
-    if os.path.exists(UPLOAD_FOLDER):
-        for filename in os.listdir(UPLOAD_FOLDER):
-            if allowed_file(filename):
-                filepath = os.path.join(UPLOAD_FOLDER, filename)
-                info = get_image_info(filepath)
-                images.append({
-                    'filename': filename,
-                    'size': info['size'],
-                    'uploaded': info['uploaded']
-                })
-    
-    # 最新順にソート
-    images.sort(key=lambda x: x['uploaded'], reverse=True)
-    return render_template('index.html', images=images)
+    cursor = request.args.get('cursor')
+    images, next_cursor = image_index.list_images(limit=PAGE_SIZE, cursor=cursor)
+    for image in images:
+        image['thumbnail_pending'] = thumbnail_queue.status(image['filename']) == STATUS_PENDING
+    return render_template('index.html', images=images, next_cursor=next_cursor,
+                           is_first_page=not cursor)
 
 @app.route('/upload', methods=['POST'])
 def upload_files():
@@ -127,7 +206,7 @@ def upload_files():
         - 複数ファイルの同時アップロード対応
         - ファイル形式バリデーション
         - 安全なファイル名生成（重複回避）
-        - サムネイル自動生成
+        - サムネイル生成ジョブをバックグラウンドキューに投入
         - エラーハンドリングとユーザーフィードバック
     
     Returns:
@@ -137,7 +216,9 @@ def upload_files():
         - request.files.getlist()で複数ファイル取得
         - secure_filename()でセキュアなファイル名に変換
         - UUID追加で重複ファイル名を回避
-        - サムネイル作成失敗時は元ファイルは保持
+        - サムネイル作成はThumbnailQueueのワーカーで並列実行され、完了を待たずに応答
+        - サムネイル作成失敗時は元ファイルは保持（状態は/thumbnail-statusで確認）
+        - 保存したファイルはImageIndexに登録
         - flash()でアップロード結果をユーザーに通知
     """
     if 'files' not in request.files:
@@ -157,15 +238,15 @@ def upload_files():
             # ファイル保存
             filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
             file.save(filepath)
+            image_index.add_image(unique_filename, os.path.getsize(filepath),
+                                  content_hash=file_content_hash(filepath))
             
-            # サムネイル作成
-            thumbnail_path = os.path.join(THUMBNAIL_FOLDER, unique_filename)
+            # サムネイル作成ジョブ投入
             try:
-                create_thumbnail(filepath, thumbnail_path)
-                uploaded_count += 1
+                thumbnail_queue.submit(unique_filename, filepath)
             except Exception as e:
                 flash(f'サムネイル作成エラー: {unique_filename}')
-                continue
+            uploaded_count += 1
     
     if uploaded_count > 0:
         flash(f'{uploaded_count}個のファイルをアップロードしました')
@@ -190,8 +271,10 @@ def uploaded_file(filename):
         - モーダル表示での拡大画像表示に使用
         - 直接ファイルパスアクセスを防ぐセキュリティ機能
         - Content-Typeは自動設定される
+        - 内容ハッシュをETagとし、フィンガープリント付きファイル名は1年間immutableでキャッシュ
     """
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    return send_image(UPLOAD_FOLDER, filename, etag=get_content_hash(filename),
+                      immutable=is_fingerprinted(filename))
 
 @app.route('/thumbnail/<filename>')
 def thumbnail_file(filename):
@@ -201,16 +284,109 @@ def thumbnail_file(filename):
     Args:
         filename (str): 取得するサムネイルファイル名
     
+    Query Parameters:
+        w (int): 派生画像の最大幅（省略時は標準サムネイル）
+        fmt (str): 派生画像の形式 jpeg/webp/png（省略時はjpeg）
+    
     Returns:
         Response: サムネイル画像ファイルのレスポンス
     
     Note:
+        - w/fmt指定時はderivative_thumbnail()で派生画像を返す
         - ギャラリーグリッド表示用の小サイズ画像を配信
         - オリジナル画像と同じファイル名でサムネイルフォルダから取得
         - 300x300px（最大）サイズでアスペクト比維持
         - ページ読み込み速度向上のため軽量化済み
+        - 生成ジョブ完了前はプレースホルダー画像を返す（キャッシュさせない）
+        - ジョブもサムネイルも無い場合（再起動で失われた等）や、失敗したジョブの再試行の待ち時間が過ぎた場合は再投入する
+        - 完成済みサムネイルは元画像と同様にETag付き・immutableでキャッシュ
+    """
+    if 'w' in request.args or 'fmt' in request.args:
+        return derivative_thumbnail(filename)
+    
+    status = thumbnail_queue.status(filename)
+    if status == STATUS_DONE:
+        content_hash = get_content_hash(filename)
+        etag = f'{content_hash[:32]}-thumb' if content_hash else None
+        return send_image(THUMBNAIL_FOLDER, filename, etag=etag,
+                          immutable=is_fingerprinted(filename))
+
+    original_path = os.path.join(UPLOAD_FOLDER, filename)
+    if status is None and filename == secure_filename(filename) and os.path.exists(original_path):
+        thumbnail_queue.submit(filename, original_path)
+
+    response = send_from_directory(PLACEHOLDER_FOLDER, PLACEHOLDER_FILE)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def derivative_thumbnail(filename):
+    """
+    サイズ・形式を指定した派生画像を返す関数
+    
+    Args:
+        filename (str): 元画像のファイル名
+    
+    Returns:
+        Response: 派生画像ファイルのレスポンス
+    
+    Note:
+        - 幅はDERIVATIVE_WIDTHSのいずれかに切り上げ（任意サイズでキャッシュが膨らむのを防ぐ）
+        - 元画像の内容ハッシュ + パラメータをキーにDerivativeCacheで生成・保存
+        - 内容ハッシュ未登録の既存画像はここで計算してインデックスに保存
+        - JPEGはdraftモードで縮小デコードするため、小さな出力ほど高速
+        - 内容ハッシュ + パラメータがそのままETagになるため、304判定は生成前に行える
+        - フィンガープリント付きのファイル名の派生画像だけimmutableで配信
+    """
+    fmt = request.args.get('fmt', 'jpeg').lower()
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    # wを省略した場合だけ既定の幅にする（数値でない値や0以下は400）
+    width = request.args.get('w', type=int) if 'w' in request.args else DERIVATIVE_WIDTHS[0]
+    if fmt not in FORMATS or width is None or width <= 0:
+        return jsonify({'error': '不正なパラメータです'}), 400
+    
+    image = image_index.get_image(filename)
+    original_path = os.path.join(UPLOAD_FOLDER, filename)
+    if image is None or not os.path.exists(original_path):
+        return jsonify({'error': 'ファイルが見つかりません'}), 404
+    
+    content_hash = image['content_hash']
+    if not content_hash:
+        content_hash = file_content_hash(original_path)
+        image_index.set_content_hash(filename, content_hash)
+    
+    width = derivative_cache.normalize_width(width)
+    etag = f'{content_hash[:32]}-w{width}-{fmt}'
+    # URLに内容ハッシュを含まないため、フィンガープリントのない旧形式のファイル名は
+    # 元画像が置き換えられうるのでimmutableにしない
+    immutable = is_fingerprinted(filename)
+    if etag in request.if_none_match:
+        return not_modified(etag, immutable)
+    
+    cache_name, mimetype = derivative_cache.get(original_path, content_hash, width, fmt)
+    return send_image(DERIVATIVE_FOLDER, cache_name, etag=etag, immutable=immutable,
+                      mimetype=mimetype)
+
+@app.route('/thumbnail-status')
+def thumbnail_status():
+    """
+    サムネイル生成ジョブの状態確認API
+    
+    Query Parameters:
+        filenames (str): カンマ区切りの画像ファイル名
+    
+    Returns:
+        Response: {ファイル名: 状態} のJSON
+            - pending: 生成中
+            - done: 完了
+            - error: 生成失敗
+            - null: ジョブなし
+    
+    Note:
+        - gallery.jsが生成中のサムネイルをポーリングし、完了したら差し替える
     """
-    return send_from_directory(THUMBNAIL_FOLDER, filename)
+    filenames = [f for f in request.args.get('filenames', '').split(',') if f]
+    return jsonify({f: thumbnail_queue.status(f) for f in filenames})
 
 @app.route('/delete/<filename>', methods=['POST'])
 def delete_file(filename):
@@ -225,6 +401,8 @@ def delete_file(filename):
     
     機能:
         - オリジナル画像とサムネイルを同時削除
+        - ImageIndexからも登録を削除
+        - 派生画像キャッシュも削除
         - ファイル存在チェック後に安全に削除
         - エラー発生時の適切なエラーハンドリング
         - ユーザーへの削除結果フィードバック
@@ -246,6 +424,13 @@ def delete_file(filename):
         if os.path.exists(thumbnail_path):
             os.remove(thumbnail_path)
         
+        # 派生画像削除
+        image = image_index.get_image(filename)
+        if image and image['content_hash']:
+            derivative_cache.purge(image['content_hash'])
+        
+        image_index.remove_image(filename)
+        thumbnail_queue.forget(filename)
         flash(f'{filename} を削除しました')
     except Exception as e:
         flash(f'削除エラー: {str(e)}')
@@ -0,0 +1,198 @@
+import os
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+# 出力形式ごとの保存設定
+FORMATS = {
+    'jpeg': {'ext': 'jpg', 'format': 'JPEG', 'mimetype': 'image/jpeg'},
+    'webp': {'ext': 'webp', 'format': 'WEBP', 'mimetype': 'image/webp'},
+    'png': {'ext': 'png', 'format': 'PNG', 'mimetype': 'image/png'},
+}
+
+
+def file_content_hash(filepath, chunk_size=1024 * 1024):
+    """
+    ファイル内容のSHA-256ハッシュを計算する関数
+
+    Args:
+        filepath (str): 対象ファイルのパス
+        chunk_size (int): 1回に読み込むバイト数
+
+    Returns:
+        str: 16進数表記のハッシュ値
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def render_derivative(image_path, output_path, width, fmt, quality=85):
+    """
+    元画像から指定幅・形式の派生画像を作成する関数
+
+    Args:
+        image_path (str): 元画像ファイルのパス
+        output_path (str): 派生画像の保存先パス
+        width (int): 最大幅（高さも同じ値を上限にアスペクト比維持）
+        fmt (str): 出力形式（FORMATSのキー）
+        quality (int): JPEG/WebPの品質
+
+    Note:
+        - JPEGはdraft()でDCTスケーリングを使い、必要な解像度だけデコード
+          （1/2, 1/4, 1/8の縮小デコードで全画素の展開を避ける）
+        - 一時ファイルに書き出してからos.replace()で置き換え
+    """
+    spec = FORMATS[fmt]
+    tmp_path = f'{output_path}.{uuid.uuid4().hex[:8]}.tmp'
+    try:
+        with Image.open(image_path) as image:
+            if image.format == 'JPEG':
+                image.draft('RGB', (width, width))
+            image.thumbnail((width, width), Image.Resampling.LANCZOS)
+            if spec['format'] == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            image.save(tmp_path, format=spec['format'], optimize=True, quality=quality)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class DerivativeCache:
+    """
+    サイズ・形式別の派生画像をオンデマンド生成するディスクキャッシュ
+
+    Note:
+        - キーは「元画像の内容ハッシュ + 幅 + 形式」のため、同一内容の画像は派生画像を共有
+        - 初回リクエスト時に生成し、以降は保存済みファイルを返す
+        - 合計サイズがmax_bytesを超えたら最終アクセスの古い順（LRU）に削除
+        - アクセス順はmtimeにも反映するため、再起動後もLRU順を復元できる
+        - 同じキーの同時リクエストは1回だけ生成する（キー単位のロック）
+    """
+
+    def __init__(self, cache_folder, max_bytes, widths, quality=85):
+        """
+        Args:
+            cache_folder (str): 派生画像の保存フォルダ
+            max_bytes (int): キャッシュ全体の上限サイズ（バイト）
+            widths (tuple): 許可する幅の一覧（要求幅は一覧内の値に切り上げ）
+            quality (int): JPEG/WebPの品質
+        """
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self.widths = tuple(sorted(widths))
+        self.quality = quality
+        self._entries = OrderedDict()  # キャッシュファイル名 -> サイズ（古い順）
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        os.makedirs(cache_folder, exist_ok=True)
+        self._load_entries()
+
+    def _load_entries(self):
+        entries = []
+        with os.scandir(self.cache_folder) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._entries[name] = size
+            self._total_bytes += size
+
+    def normalize_width(self, width):
+        """
+        Args:
+            width (int): 要求された幅
+
+        Returns:
+            int: 許可された幅のうち要求以上で最小の値（上限を超える場合は最大値）
+        """
+        for allowed in self.widths:
+            if width <= allowed:
+                return allowed
+        return self.widths[-1]
+
+    def get(self, image_path, content_hash, width, fmt):
+        """
+        派生画像を取得する（未生成の場合は生成してキャッシュ）
+
+        Args:
+            image_path (str): 元画像ファイルのパス
+            content_hash (str): 元画像の内容ハッシュ
+            width (int): 要求幅
+            fmt (str): 出力形式（FORMATSのキー）
+
+        Returns:
+            tuple: (キャッシュファイル名, MIMEタイプ)
+        """
+        spec = FORMATS[fmt]
+        width = self.normalize_width(width)
+        name = f"{content_hash[:32]}_w{width}.{spec['ext']}"
+        path = os.path.join(self.cache_folder, name)
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(name, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                hit = name in self._entries and os.path.exists(path)
+                if hit:
+                    self._entries.move_to_end(name)
+            if hit:
+                os.utime(path)
+            else:
+                render_derivative(image_path, path, width, fmt, self.quality)
+                self._add_entry(name, os.path.getsize(path))
+
+        return name, spec['mimetype']
+
+    def _add_entry(self, name, size):
+        evicted = []
+        with self._lock:
+            self._total_bytes -= self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_name, old_size = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                self._key_locks.pop(old_name, None)
+                evicted.append(old_name)
+        for old_name in evicted:
+            self._remove_file(old_name)
+
+    def purge(self, content_hash):
+        """
+        指定した元画像の派生画像をすべて削除する
+
+        Args:
+            content_hash (str): 元画像の内容ハッシュ
+        """
+        prefix = f'{content_hash[:32]}_'
+        with self._lock:
+            names = [name for name in self._entries if name.startswith(prefix)]
+            for name in names:
+                self._total_bytes -= self._entries.pop(name)
+                self._key_locks.pop(name, None)
+        for name in names:
+            self._remove_file(name)
+
+    def _remove_file(self, name):
+        try:
+            os.remove(os.path.join(self.cache_folder, name))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        """
+        Returns:
+            dict: キャッシュ件数と合計サイズ
+        """
+        with self._lock:
+            return {'entries': len(self._entries), 'total_bytes': self._total_bytes,
+                    'max_bytes': self.max_bytes}
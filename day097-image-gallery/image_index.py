@@ -0,0 +1,213 @@
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+
+class ImageIndex:
+    """
+    アップロード画像のメタデータを管理するSQLiteインデックス
+
+    Note:
+        - 一覧表示のたびにos.listdir()/os.stat()を実行しないための永続インデックス
+        - upload_files()/delete_file()から追加・削除して常に最新状態を保持
+        - (uploaded_at, id) の複合インデックスでキーセットページネーション
+        - 一覧取得のコストはディレクトリ全体ではなくページサイズに比例
+    """
+
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path (str): SQLiteデータベースファイルのパス
+        """
+        self.db_path = db_path
+        self.init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_db(self):
+        """
+        テーブルとインデックスを作成する（既存の場合は何もしない）
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS images (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    filename TEXT NOT NULL UNIQUE,
+                    size INTEGER NOT NULL,
+                    uploaded_at REAL NOT NULL,
+                    content_hash TEXT
+                )
+            """)
+            # 旧バージョンのDBにはcontent_hash列がないため追加
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(images)')]
+            if 'content_hash' not in columns:
+                conn.execute('ALTER TABLE images ADD COLUMN content_hash TEXT')
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_images_uploaded
+                ON images (uploaded_at DESC, id DESC)
+            """)
+
+    def count(self):
+        """
+        Returns:
+            int: インデックスに登録されている画像数
+        """
+        with closing(self._connect()) as conn:
+            return conn.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+
+    def add_image(self, filename, size, uploaded_at=None, content_hash=None):
+        """
+        画像をインデックスに登録する
+
+        Args:
+            filename (str): 保存済みファイル名
+            size (int): ファイルサイズ（バイト）
+            uploaded_at (float): アップロード日時（UNIXタイムスタンプ）、省略時は現在時刻
+            content_hash (str): ファイル内容のハッシュ値（派生画像キャッシュのキー）
+        """
+        if uploaded_at is None:
+            uploaded_at = datetime.now().timestamp()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO images (filename, size, uploaded_at, content_hash) '
+                'VALUES (?, ?, ?, ?)',
+                (filename, size, uploaded_at, content_hash)
+            )
+
+    def set_content_hash(self, filename, content_hash):
+        """
+        内容ハッシュを後から登録する（ハッシュ未登録の既存画像用）
+
+        Args:
+            filename (str): 対象のファイル名
+            content_hash (str): ファイル内容のハッシュ値
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute('UPDATE images SET content_hash = ? WHERE filename = ?',
+                         (content_hash, filename))
+
+    def remove_image(self, filename):
+        """
+        画像をインデックスから削除する
+
+        Args:
+            filename (str): 削除対象のファイル名
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM images WHERE filename = ?', (filename,))
+
+    def get_image(self, filename):
+        """
+        Args:
+            filename (str): 取得対象のファイル名
+
+        Returns:
+            dict | None: 画像情報、未登録の場合None
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                'SELECT id, filename, size, uploaded_at, content_hash FROM images WHERE filename = ?',
+                (filename,)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list_images(self, limit=40, cursor=None):
+        """
+        アップロード日時の新しい順に画像を1ページ分取得する
+
+        Args:
+            limit (int): 1ページあたりの件数
+            cursor (str): 前ページ末尾のカーソル（"uploaded_at:id"形式）、先頭ページはNone
+
+        Returns:
+            tuple: (画像情報のリスト, 次ページのカーソル または None)
+
+        Note:
+            - OFFSETを使わずWHERE条件で続きから読むキーセット方式
+            - limit+1件取得して次ページの有無を判定
+        """
+        params = []
+        where = ''
+        position = self.parse_cursor(cursor)
+        if position:
+            where = 'WHERE uploaded_at < ? OR (uploaded_at = ? AND id < ?)'
+            params.extend([position[0], position[0], position[1]])
+        params.append(limit + 1)
+
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f'SELECT id, filename, size, uploaded_at, content_hash FROM images {where} '
+                'ORDER BY uploaded_at DESC, id DESC LIMIT ?',
+                params
+            ).fetchall()
+
+        images = [self._to_dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = f"{last['uploaded_at']!r}:{last['id']}"
+        return images, next_cursor
+
+    def rebuild_from_directory(self, upload_folder, is_allowed):
+        """
+        アップロードフォルダを走査してインデックスを再構築する
+
+        Args:
+            upload_folder (str): アップロード画像の保存フォルダ
+            is_allowed (callable): ファイル名を受け取り対象かどうかを返す関数
+
+        Returns:
+            int: 登録した画像数
+
+        Note:
+            - インデックス導入前の既存画像を取り込むための初回移行用
+            - 通常のリクエスト処理からは呼び出さない
+        """
+        entries = []
+        if os.path.exists(upload_folder):
+            with os.scandir(upload_folder) as it:
+                for entry in it:
+                    if entry.is_file() and is_allowed(entry.name):
+                        stat = entry.stat()
+                        entries.append((entry.name, stat.st_size, stat.st_mtime))
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM images')
+            conn.executemany(
+                'INSERT INTO images (filename, size, uploaded_at) VALUES (?, ?, ?)',
+                sorted(entries, key=lambda e: e[2])
+            )
+        return len(entries)
+
+    @staticmethod
+    def parse_cursor(cursor):
+        """
+        Args:
+            cursor (str): "uploaded_at:id"形式のカーソル文字列
+
+        Returns:
+            tuple | None: (uploaded_at, id)、不正な値の場合None
+        """
+        if not cursor:
+            return None
+        try:
+            uploaded_at, image_id = cursor.rsplit(':', 1)
+            return float(uploaded_at), int(image_id)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _to_dict(row):
+        return {
+            'id': row['id'],
+            'filename': row['filename'],
+            'size': round(row['size'] / 1024, 2),  # KB
+            'uploaded_at': row['uploaded_at'],
+            'content_hash': row['content_hash'],
+            'uploaded': datetime.fromtimestamp(row['uploaded_at']).strftime('%Y-%m-%d %H:%M:%S')
+        }
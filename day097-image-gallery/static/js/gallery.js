@@ -123,6 +123,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const modalFilename = document.getElementById('modalFilename');
     const modalSize = document.getElementById('modalSize');
     const modalUploaded = document.getElementById('modalUploaded');
+    const modalOriginalLink = document.getElementById('modalOriginalLink');
     
     // サムネイルクリック時のモーダル表示
     document.querySelectorAll('.gallery-thumbnail').forEach(thumbnail => {
@@ -133,6 +134,7 @@ document.addEventListener('DOMContentLoaded', function() {
             const uploaded = this.dataset.uploaded;
             
             modalImage.src = src;
+            modalOriginalLink.href = this.dataset.original;
             modalTitle.textContent = filename;
             modalFilename.textContent = filename;
             modalSize.textContent = size;
@@ -176,6 +178,42 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // 生成中サムネイルのポーリング
+    const pendingThumbnails = new Map();
+    document.querySelectorAll('.gallery-thumbnail[data-thumbnail-pending]').forEach(img => {
+        pendingThumbnails.set(img.dataset.filename, img);
+    });
+    
+    function pollThumbnailStatus() {
+        if (pendingThumbnails.size === 0) return;
+        
+        const filenames = Array.from(pendingThumbnails.keys()).join(',');
+        fetch(`/thumbnail-status?filenames=${encodeURIComponent(filenames)}`)
+            .then(response => response.json())
+            .then(statuses => {
+                Object.entries(statuses).forEach(([filename, status]) => {
+                    if (status === 'pending') return;
+                    const img = pendingThumbnails.get(filename);
+                    if (status === 'done') {
+                        // キャッシュ回避のためクエリを付けて再取得
+                        const base = img.src.split('?')[0];
+                        img.src = `${base}?t=${Date.now()}`;
+                        img.srcset = `${img.src} 1x, ${base}?w=600&fmt=webp 2x`;
+                    }
+                    delete img.dataset.thumbnailPending;
+                    pendingThumbnails.delete(filename);
+                });
+            })
+            .catch(error => console.error('サムネイル状態取得エラー:', error))
+            .finally(() => {
+                if (pendingThumbnails.size > 0) {
+                    setTimeout(pollThumbnailStatus, 1000);
+                }
+            });
+    }
+    
+    setTimeout(pollThumbnailStatus, 1000);
+    
     // タッチデバイス対応
     if ('ontouchstart' in window) {
         document.querySelectorAll('.gallery-item').forEach(item => {
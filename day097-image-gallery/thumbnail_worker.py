@@ -0,0 +1,166 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+# ジョブの状態
+STATUS_PENDING = 'pending'
+STATUS_DONE = 'done'
+STATUS_ERROR = 'error'
+
+
+def create_thumbnail(image_path, thumbnail_path, size=(300, 300)):
+    """
+    アップロード画像からサムネイル画像を作成する関数
+
+    Args:
+        image_path (str): 元画像ファイルのパス
+        thumbnail_path (str): サムネイル保存先パス
+        size (tuple): サムネイルサイズ (幅, 高さ)、デフォルト(300, 300)
+
+    Note:
+        - Pillowライブラリを使用してリサイズ処理
+        - LANCZOSリサンプリングで高品質な縮小
+        - optimize=True, quality=85でファイルサイズ最適化
+        - アスペクト比を維持してリサイズ
+        - 一意な一時ファイルに書き出してからos.replace()で置き換えるため、
+          作成途中のサムネイルが配信されることはない（複数のプロセスが同じ画像を処理しても衝突しない）
+        - ワーカープロセスから呼ばれるためモジュール直下に定義
+
+    Raises:
+        Exception: 画像ファイルの読み込みや保存に失敗した場合
+    """
+    folder, name = os.path.split(thumbnail_path)
+    # 保存形式は拡張子から決まるため、一時ファイルも同じ拡張子にする
+    fd, tmp_path = tempfile.mkstemp(dir=folder or '.', prefix=f'.{name}.', suffix=os.path.splitext(name)[1])
+    os.close(fd)
+    try:
+        with Image.open(image_path) as image:
+            image.thumbnail(size, Image.Resampling.LANCZOS)
+            image.save(tmp_path, optimize=True, quality=85)
+        os.replace(tmp_path, thumbnail_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class ThumbnailQueue:
+    """
+    サムネイル生成をリクエスト処理から切り離すジョブキュー
+
+    Note:
+        - ProcessPoolExecutorで複数コアに分散して並列にリサイズ
+        - ジョブ状態（pending/done/error）はファイル名をキーにメモリ上で管理
+        - 失敗したジョブはretry_delay秒（失敗するたびに倍、最大max_retry_delay秒）経つと
+          errorを解除し、次のリクエストで再投入される
+        - プールは最初のジョブ投入時に起動（インポート時にプロセスを作らない）
+        - 再起動で状態が失われても、サムネイルファイルの有無から完了を判定できる
+        - 状態はプロセスごとに持つため、アプリを複数プロセスで動かすと
+          同じ画像のジョブがプロセスごとに投入されることがある（結果のファイルは同じ）
+    """
+
+    def __init__(self, thumbnail_folder, max_workers=None, retry_delay=5, max_retry_delay=300):
+        """
+        Args:
+            thumbnail_folder (str): サムネイル保存フォルダ
+            max_workers (int): ワーカープロセス数、省略時はCPUコア数
+            retry_delay (float): 失敗したジョブを再投入できるまでの秒数（初回）
+            max_retry_delay (float): 再投入までの秒数の上限
+        """
+        self.thumbnail_folder = thumbnail_folder
+        self.max_workers = max_workers
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._executor = None
+        self._jobs = {}
+        self._failures = {}  # ファイル名 -> (連続失敗回数, 再投入できる時刻)
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def submit(self, filename, image_path):
+        """
+        サムネイル生成ジョブを投入する
+
+        Args:
+            filename (str): 画像ファイル名（サムネイルも同名で保存）
+            image_path (str): 元画像ファイルのパス
+
+        Returns:
+            str: 投入後のジョブ状態
+        """
+        with self._lock:
+            if self._jobs.get(filename) == STATUS_PENDING:
+                return STATUS_PENDING
+            self._jobs[filename] = STATUS_PENDING
+
+        thumbnail_path = os.path.join(self.thumbnail_folder, filename)
+        try:
+            future = self._get_executor().submit(create_thumbnail, image_path, thumbnail_path)
+        except Exception:
+            self._record_failure(filename)
+            raise
+        future.add_done_callback(lambda f: self._on_done(filename, f))
+        return STATUS_PENDING
+
+    def _on_done(self, filename, future):
+        # 成功したジョブはサムネイルファイル自体が完了の証拠になるため状態を保持しない
+        if future.cancelled() or future.exception() is not None:
+            self._record_failure(filename)
+        else:
+            self.forget(filename)
+
+    def _record_failure(self, filename):
+        # 一時的な失敗で永久にプレースホルダーのままにならないよう、時間をおいて再試行させる
+        with self._lock:
+            failures = self._failures.get(filename, (0, 0))[0] + 1
+            delay = min(self.retry_delay * 2 ** (failures - 1), self.max_retry_delay)
+            self._failures[filename] = (failures, time.monotonic() + delay)
+            self._jobs[filename] = STATUS_ERROR
+
+    def status(self, filename):
+        """
+        ジョブ状態を取得する
+
+        Args:
+            filename (str): 画像ファイル名
+
+        Returns:
+            str | None: pending/done/error、ジョブもサムネイルもない場合
+                （失敗後に再試行できる時刻を過ぎた場合を含む）None
+        """
+        with self._lock:
+            status = self._jobs.get(filename)
+            if status == STATUS_ERROR and time.monotonic() >= self._failures[filename][1]:
+                # 再試行の待ち時間を過ぎたらerrorを解除する（失敗回数は次の待ち時間のため残す）
+                del self._jobs[filename]
+                status = None
+        if status is not None:
+            return status
+        if os.path.exists(os.path.join(self.thumbnail_folder, filename)):
+            return STATUS_DONE
+        return None
+
+    def forget(self, filename):
+        """
+        Args:
+            filename (str): 状態を破棄する画像ファイル名（削除時に使用）
+        """
+        with self._lock:
+            self._jobs.pop(filename, None)
+            self._failures.pop(filename, None)
+
+    def shutdown(self):
+        """
+        ワーカープロセスを停止する（実行中のジョブは完了を待つ）
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -1,9 +1,18 @@
 from flask import Flask, render_template, request, redirect, url_for, flash
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text, or_, and_, insert, update
+from sqlalchemy.orm import load_only
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime
+import click
+import glob
+import hashlib
 import os
+import threading
+import time
 from dotenv import load_dotenv
 import markdown
+from search import create_search_backend
 
 load_dotenv()
 
@@ -14,24 +23,282 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db = SQLAlchemy(app)
 
+# Markdown変換の設定。拡張機能や設定を変えたらRENDER_VERSIONを上げると、
+# 保存済みのHTMLは閲覧時にバックグラウンドで再変換される
+MARKDOWN_EXTENSIONS = ['codehilite', 'fenced_code']
+RENDER_VERSION = 1
+
+POSTS_PER_PAGE = 20
+EXCERPT_LENGTH = 200
+
+# 一括インポートの設定
+MARKDOWN_SUFFIXES = ('.md', '.markdown')
+IMPORT_BATCH_SIZE = 200
+IMPORT_WORKERS = min(4, os.cpu_count() or 1)
+
+SEARCH_RESULTS_PER_PAGE = 10
+
 class Post(db.Model):
+    __table_args__ = (
+        # 一覧のキーセットページネーション用（created_at降順、同時刻はid降順）
+        db.Index('ix_post_created_at_id', 'created_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
     markdown_content = db.Column(db.Text, nullable=False)
+    excerpt = db.Column(db.String(EXCERPT_LENGTH + 3), nullable=False, default='', server_default='')
+    render_version = db.Column(db.Integer, nullable=False, default=RENDER_VERSION, server_default='0')
+    # ファイルから読み込んだ記事の元ファイル（絶対パス）と内容のSHA-256
+    source_path = db.Column(db.String(500), index=True)
+    content_hash = db.Column(db.String(64))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+def render_markdown(markdown_content):
+    return markdown.markdown(markdown_content, extensions=MARKDOWN_EXTENSIONS)
+
+def make_excerpt(markdown_content):
+    if len(markdown_content) > EXCERPT_LENGTH:
+        return markdown_content[:EXCERPT_LENGTH] + '...'
+    return markdown_content
+
+def ensure_schema():
+    db.create_all()
+    # 既存のpostテーブルに後から追加した列を補う
+    columns = {column['name'] for column in inspect(db.engine).get_columns('post')}
+    if 'render_version' not in columns:
+        with db.engine.begin() as conn:
+            conn.execute(text('ALTER TABLE post ADD COLUMN render_version INTEGER NOT NULL DEFAULT 0'))
+    if 'excerpt' not in columns:
+        with db.engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE post ADD COLUMN excerpt VARCHAR({EXCERPT_LENGTH + 3}) NOT NULL DEFAULT ''"))
+        backfill_excerpts()
+    for name, column_type in (('source_path', 'VARCHAR(500)'), ('content_hash', 'VARCHAR(64)')):
+        if name not in columns:
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE post ADD COLUMN {name} {column_type}'))
+    for index in Post.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    get_search_backend()
+
+# 全文検索の索引（SQLiteはFTS5、MySQLはFULLTEXT、それ以外はLIKE）。
+# 索引はデータベース側で記事の作成・編集・削除に追従する
+search_backend = None
+search_backend_lock = threading.Lock()
+
+def get_search_backend():
+    global search_backend
+    with search_backend_lock:
+        if search_backend is None:
+            backend = create_search_backend(db.engine, os.getenv('SEARCH_BACKEND'))
+            backend.install(db.engine)
+            search_backend = backend
+    return search_backend
+
+def backfill_excerpts(batch_size=500):
+    last_id = 0
+    while True:
+        posts = (Post.query.options(load_only(Post.id, Post.markdown_content))
+                 .filter(Post.id > last_id).order_by(Post.id).limit(batch_size).all())
+        if not posts:
+            break
+        for post in posts:
+            post.excerpt = make_excerpt(post.markdown_content)
+        db.session.commit()
+        last_id = posts[-1].id
+
+def encode_cursor(post):
+    return f'{post.created_at.isoformat()}_{post.id}'
+
+def decode_cursor(cursor):
+    try:
+        created_at, post_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(post_id)
+    except (AttributeError, ValueError):
+        return None
+
+def find_markdown_files(source):
+    # ディレクトリなら配下の.md/.markdownを再帰的に、それ以外はglobパターンとして展開
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            paths.extend(os.path.join(root, name) for name in files
+                         if name.lower().endswith(MARKDOWN_SUFFIXES))
+    else:
+        paths = [path for path in glob.glob(source, recursive=True) if os.path.isfile(path)]
+    return sorted({os.path.abspath(path) for path in paths})
+
+def read_markdown_file(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return data.decode('utf-8'), hashlib.sha256(data).hexdigest()
+
+def import_markdown_files(paths, workers=IMPORT_WORKERS, batch_size=IMPORT_BATCH_SIZE):
+    # 変更のないファイル（同じパス・同じ内容ハッシュ）は変換せずにスキップし、
+    # 残りをプロセスプールで変換して batch_size 件ずつ1トランザクションで保存する
+    start = time.perf_counter()
+    result = {'files': len(paths), 'created': 0, 'updated': 0, 'skipped': 0, 'errors': []}
+    executor = None
+    # ワーカー数より多いファイルがあればプロセスプールを使う（batch_sizeは保存の単位で、並列化の判定には使わない）
+    if workers > 1 and len(paths) > workers:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for offset in range(0, len(paths), batch_size):
+            batch = paths[offset:offset + batch_size]
+            existing = {
+                row.source_path: row for row in
+                db.session.query(Post.id, Post.source_path, Post.content_hash)
+                .filter(Post.source_path.in_(batch))
+            }
+            
+            pending = []
+            for path in batch:
+                try:
+                    markdown_content, content_hash = read_markdown_file(path)
+                except (OSError, UnicodeDecodeError) as e:
+                    result['errors'].append(f'{path}: {e}')
+                    continue
+                row = existing.get(path)
+                if row is not None and row.content_hash == content_hash:
+                    result['skipped'] += 1
+                    continue
+                pending.append((path, markdown_content, content_hash, row))
+            
+            texts = [markdown_content for _, markdown_content, _, _ in pending]
+            if executor:
+                chunksize = max(1, len(texts) // (workers * 4))
+                rendered = executor.map(render_markdown, texts, chunksize=chunksize)
+            else:
+                rendered = map(render_markdown, texts)
+            
+            now = datetime.utcnow()
+            new_posts, changed_posts = [], []
+            for (path, markdown_content, content_hash, row), html_content in zip(pending, rendered):
+                values = {
+                    'content': html_content,
+                    'markdown_content': markdown_content,
+                    'excerpt': make_excerpt(markdown_content),
+                    'render_version': RENDER_VERSION,
+                    'content_hash': content_hash,
+                    'updated_at': now,
+                }
+                if row is None:
+                    values.update(title=os.path.splitext(os.path.basename(path))[0],
+                                  source_path=path, created_at=now)
+                    new_posts.append(values)
+                else:
+                    values['id'] = row.id
+                    changed_posts.append(values)
+            
+            if new_posts:
+                db.session.execute(insert(Post), new_posts)
+            if changed_posts:
+                db.session.execute(update(Post), changed_posts)
+            db.session.commit()
+            result['created'] += len(new_posts)
+            result['updated'] += len(changed_posts)
+    finally:
+        if executor:
+            executor.shutdown()
+    
+    result['elapsed'] = time.perf_counter() - start
+    result['files_per_sec'] = len(paths) / result['elapsed'] if result['elapsed'] else 0.0
+    return result
+
+def format_import_result(result):
+    return (f"{result['files']}件中 新規{result['created']}件・更新{result['updated']}件・"
+            f"変更なし{result['skipped']}件・エラー{len(result['errors'])}件 "
+            f"({result['elapsed']:.2f}秒, {result['files_per_sec']:.0f}件/秒)")
+
+@app.cli.command('import-markdown')
+@click.argument('source')
+@click.option('--workers', default=IMPORT_WORKERS, show_default=True, help='変換に使うプロセス数')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True, help='1トランザクションで保存する件数')
+def import_markdown_command(source, workers, batch_size):
+    """ディレクトリまたはglobパターンのMarkdownファイルを一括で読み込む"""
+    ensure_schema()
+    paths = find_markdown_files(source)
+    if not paths:
+        raise click.ClickException(f'Markdownファイルが見つかりません: {source}')
+    result = import_markdown_files(paths, workers=workers, batch_size=batch_size)
+    for error in result['errors']:
+        click.echo(f'エラー: {error}', err=True)
+    click.echo(format_import_result(result))
+
+# 古いRENDER_VERSIONで保存されたHTMLの再変換（リクエストの外で1件ずつ処理）
+rerender_executor = ThreadPoolExecutor(max_workers=1)
+rerender_pending = set()
+rerender_lock = threading.Lock()
+
+def schedule_rerender(post_id):
+    with rerender_lock:
+        if post_id in rerender_pending:
+            return
+        rerender_pending.add(post_id)
+    rerender_executor.submit(rerender_post, post_id)
+
+def rerender_post(post_id):
+    try:
+        with app.app_context():
+            post = db.session.get(Post, post_id)
+            if post is None or post.render_version == RENDER_VERSION:
+                return
+            markdown_content = post.markdown_content
+            html_content = render_markdown(markdown_content)
+            # 変換中に記事が編集されていたら上書きしない
+            Post.query.filter_by(id=post_id, markdown_content=markdown_content).update(
+                {'content': html_content, 'render_version': RENDER_VERSION},
+                synchronize_session=False
+            )
+            db.session.commit()
+    except Exception as e:
+        print(f'再変換エラー (post {post_id}): {e}')
+    finally:
+        with rerender_lock:
+            rerender_pending.discard(post_id)
+
 @app.route('/')
 def index():
-    posts = Post.query.order_by(Post.created_at.desc()).all()
-    return render_template('index.html', posts=posts)
+    # 一覧に必要な列だけを読み込み、本文（content / markdown_content）は読まない
+    query = (Post.query
+             .options(load_only(Post.id, Post.title, Post.excerpt, Post.created_at, Post.updated_at))
+             .order_by(Post.created_at.desc(), Post.id.desc()))
+    
+    position = decode_cursor(request.args.get('cursor'))
+    if position:
+        created_at, post_id = position
+        query = query.filter(or_(Post.created_at < created_at,
+                                 and_(Post.created_at == created_at, Post.id < post_id)))
+    
+    # 1件多く取得して次のページがあるかを判定（OFFSETは使わない）
+    posts = query.limit(POSTS_PER_PAGE + 1).all()
+    next_cursor = encode_cursor(posts[POSTS_PER_PAGE - 1]) if len(posts) > POSTS_PER_PAGE else None
+    return render_template('index.html', posts=posts[:POSTS_PER_PAGE], next_cursor=next_cursor,
+                           is_first_page=position is None)
+
+@app.route('/search')
+def search():
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    results, has_next = [], False
+    elapsed_ms = None
+    if query:
+        start = time.perf_counter()
+        results, has_next = get_search_backend().search(
+            db.session, query, page=page, per_page=SEARCH_RESULTS_PER_PAGE)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    return render_template('search.html', query=query, results=results, page=page,
+                           has_next=has_next, elapsed_ms=elapsed_ms)
 
 @app.route('/post/<int:id>')
 def post_detail(id):
     post = Post.query.get_or_404(id)
-    html_content = markdown.markdown(post.markdown_content, extensions=['codehilite', 'fenced_code'])
-    return render_template('post_detail.html', post=post, html_content=html_content)
+    # 保存済みのHTMLをそのまま表示し、変換設定が古い場合だけ裏で再変換する
+    if post.render_version != RENDER_VERSION:
+        schedule_rerender(post.id)
+    return render_template('post_detail.html', post=post, html_content=post.content)
 
 @app.route('/create', methods=['GET', 'POST'])
 def create_post():
@@ -39,12 +306,14 @@ def create_post():
         title = request.form['title']
         markdown_content = request.form['content']
         
-        html_content = markdown.markdown(markdown_content, extensions=['codehilite', 'fenced_code'])
+        html_content = render_markdown(markdown_content)
         
         post = Post(
             title=title,
             content=html_content,
-            markdown_content=markdown_content
+            markdown_content=markdown_content,
+            excerpt=make_excerpt(markdown_content),
+            render_version=RENDER_VERSION
         )
         
         db.session.add(post)
@@ -62,7 +331,9 @@ def edit_post(id):
     if request.method == 'POST':
         post.title = request.form['title']
         post.markdown_content = request.form['content']
-        post.content = markdown.markdown(post.markdown_content, extensions=['codehilite', 'fenced_code'])
+        post.content = render_markdown(post.markdown_content)
+        post.excerpt = make_excerpt(post.markdown_content)
+        post.render_version = RENDER_VERSION
         post.updated_at = datetime.utcnow()
         
         db.session.commit()
@@ -87,22 +358,32 @@ def load_markdown():
         file_path = request.form['file_path']
         
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                markdown_content = f.read()
-            
-            title = os.path.splitext(os.path.basename(file_path))[0]
-            html_content = markdown.markdown(markdown_content, extensions=['codehilite', 'fenced_code'])
-            
-            post = Post(
-                title=title,
-                content=html_content,
-                markdown_content=markdown_content
-            )
-            
-            db.session.add(post)
-            db.session.commit()
+            if os.path.isdir(file_path) or glob.has_magic(file_path):
+                # ディレクトリ・globパターンはまとめて読み込む
+                paths = find_markdown_files(file_path)
+                if not paths:
+                    flash('Markdownファイルが見つかりません。', 'error')
+                    return render_template('load_markdown.html')
+                result = import_markdown_files(paths)
+                for error in result['errors'][:5]:
+                    flash(f'読み込めませんでした: {error}', 'error')
+                flash(f'{file_path}: {format_import_result(result)}', 'success')
+                return redirect(url_for('index'))
             
-            flash(f'{file_path}から記事を読み込みました！', 'success')
+            # 1件だけの場合も一括読み込みと同じ処理を通し、読み込み済みのファイルは
+            # スキップ（内容が同じ）または既存の記事を更新する
+            if not os.path.isfile(file_path):
+                raise FileNotFoundError(file_path)
+            result = import_markdown_files([os.path.abspath(file_path)])
+            if result['errors']:
+                flash(f'読み込めませんでした: {result["errors"][0]}', 'error')
+                return render_template('load_markdown.html')
+            if result['created']:
+                flash(f'{file_path}から記事を読み込みました！', 'success')
+            elif result['updated']:
+                flash(f'{file_path}の変更を既存の記事に反映しました。', 'success')
+            else:
+                flash(f'{file_path}は読み込み済みで、変更はありません。', 'success')
             return redirect(url_for('index'))
             
         except FileNotFoundError:
@@ -114,5 +395,5 @@ def load_markdown():
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        ensure_schema()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""記事詳細ページの表示速度ベンチマーク
+
+閲覧のたびにMarkdownを変換する方式（変更前）と、保存済みHTMLを表示する方式（変更後）を
+大きな記事のコーパスで比較する。データベースはメモリ上のSQLiteを使う。
+
+使い方:
+    python benchmark_render.py [記事数] [1記事あたりの繰り返し表示回数]
+"""
+import os
+import sys
+import time
+
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from flask import render_template
+from app import app, db, Post, render_markdown, ensure_schema, RENDER_VERSION
+
+SECTION = """
+## セクション {n}
+
+Pythonの**リスト内包表記**と`dict`の使い方を説明します。[リンク](https://example.com/{n})
+
+- 項目A: {n}
+- 項目B: `value_{n}`
+- 項目C: *強調*
+
+```python
+def process_{n}(items):
+    result = {{}}
+    for index, item in enumerate(items):
+        if item % {m} == 0:
+            result[index] = [x ** 2 for x in range(item)]
+    return sorted(result.items(), key=lambda kv: len(kv[1]), reverse=True)
+```
+
+```javascript
+const handler{n} = async (event) => {{
+  const response = await fetch(`/api/items/${{event.id}}`);
+  return response.ok ? response.json() : null;
+}};
+```
+"""
+
+
+def build_post(size):
+    return '# ベンチマーク記事\n' + ''.join(SECTION.format(n=n, m=n % 7 + 2) for n in range(size))
+
+
+def old_post_detail(post_id):
+    # 変更前: 閲覧のたびにMarkdownをHTMLへ変換
+    post = db.session.get(Post, post_id)
+    html_content = render_markdown(post.markdown_content)
+    return render_template('post_detail.html', post=post, html_content=html_content)
+
+
+def new_post_detail(post_id):
+    # 変更後: 保存済みのHTMLをそのまま表示
+    post = db.session.get(Post, post_id)
+    return render_template('post_detail.html', post=post, html_content=post.content)
+
+
+def measure(view, post_ids, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for post_id in post_ids:
+            with app.test_request_context():
+                view(post_id)
+                db.session.remove()
+    elapsed = time.perf_counter() - start
+    return elapsed * 1000 / (len(post_ids) * repeat)
+
+
+def main():
+    post_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    with app.app_context():
+        ensure_schema()
+        markdown_content = build_post(size=60)
+        for i in range(post_count):
+            db.session.add(Post(title=f'記事{i}', markdown_content=markdown_content,
+                                content=render_markdown(markdown_content),
+                                render_version=RENDER_VERSION))
+        db.session.commit()
+        post_ids = [post.id for post in Post.query.all()]
+
+        print(f'記事数: {post_count} / 1記事あたり {len(markdown_content):,} 文字 / 表示回数: {repeat}回ずつ')
+        before = measure(old_post_detail, post_ids, repeat)
+        after = measure(new_post_detail, post_ids, repeat)
+        print(f'変更前（閲覧ごとに変換）: {before:8.2f} ms/リクエスト')
+        print(f'変更後（保存済みHTML）  : {after:8.2f} ms/リクエスト')
+        print(f'高速化: {before / after:.1f}倍')
+
+
+if __name__ == '__main__':
+    main()
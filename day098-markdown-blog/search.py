@@ -0,0 +1,238 @@
+import re
+from abc import ABC, abstractmethod
+
+from markupsafe import Markup, escape
+from sqlalchemy import DateTime, inspect, text
+
+# 検索結果の強調表示に使う区切り文字（本文に含まれない制御文字を使い、エスケープ後に<mark>へ置き換える）
+MARK_OPEN = '\x02'
+MARK_CLOSE = '\x03'
+SNIPPET_CHARS = 120
+
+
+def split_terms(query):
+    return [term for term in query.split() if term]
+
+
+def highlight(value):
+    # 区切り文字入りの文字列をHTMLエスケープしてから<mark>に置き換える
+    html = str(escape(value))
+    return Markup(html.replace(MARK_OPEN, '<mark>').replace(MARK_CLOSE, '</mark>'))
+
+
+def mark_terms(value, terms):
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    return pattern.sub(lambda m: f'{MARK_OPEN}{m.group(0)}{MARK_CLOSE}', value)
+
+
+def make_snippet(value, terms, length=SNIPPET_CHARS):
+    # 最初に見つかった検索語の前後を切り出す（FTS5のsnippet()を使えないバックエンド用）
+    lowered = value.lower()
+    positions = [lowered.find(term.lower()) for term in terms]
+    positions = [pos for pos in positions if pos >= 0]
+    start = max(0, min(positions) - length // 3) if positions else 0
+    snippet = value[start:start + length]
+    prefix = '…' if start > 0 else ''
+    suffix = '…' if start + length < len(value) else ''
+    return prefix + mark_terms(snippet, terms) + suffix
+
+
+class SearchBackend(ABC):
+    """検索バックエンドの基底クラス
+
+    install() で索引を用意し、search() で (結果のリスト, 次のページがあるか) を返す。
+    結果は id / title / snippet（強調表示済みのMarkup）/ created_at を持つ辞書。
+    """
+
+    name = 'base'
+
+    def install(self, engine):
+        pass
+
+    @abstractmethod
+    def search(self, session, query, page=1, per_page=10):
+        """query に一致する記事の page ページ目と、次のページがあるかを返す"""
+
+    @staticmethod
+    def _paginate(rows, per_page):
+        return rows[:per_page], len(rows) > per_page
+
+
+class LikeSearchBackend(SearchBackend):
+    """全文検索の索引を持たないデータベース用（LIKEによる検索）"""
+
+    name = 'like'
+
+    def search(self, session, query, page=1, per_page=10):
+        terms = split_terms(query)
+        if not terms:
+            return [], False
+
+        conditions = []
+        params = {'limit': per_page + 1, 'offset': (page - 1) * per_page}
+        for i, term in enumerate(terms):
+            escaped = term.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+            params[f'term{i}'] = f'%{escaped}%'
+            conditions.append(f"(title LIKE :term{i} ESCAPE '!' OR markdown_content LIKE :term{i} ESCAPE '!')")
+        # タイトルに含まれる記事を先に、その中では新しい順
+        rows = session.execute(text(
+            'SELECT id, title, markdown_content, created_at FROM post '
+            f'WHERE {" AND ".join(conditions)} '
+            "ORDER BY CASE WHEN title LIKE :term0 ESCAPE '!' THEN 0 ELSE 1 END, created_at DESC, id DESC "
+            'LIMIT :limit OFFSET :offset'
+        ).columns(created_at=DateTime), params).all()
+
+        results = [{
+            'id': row.id,
+            'title': highlight(mark_terms(row.title, terms)),
+            'snippet': highlight(make_snippet(row.markdown_content, terms)),
+            'created_at': row.created_at,
+        } for row in rows]
+        return self._paginate(results, per_page)
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """SQLite FTS5による全文検索
+
+    postテーブルを外部コンテンツとするFTS5テーブルを作成し、トリガーで
+    INSERT / UPDATE / DELETE に追従させる（アプリ側での更新処理は不要）。
+    日本語は単語の区切りがないため、利用できればtrigramトークナイザーを使う。
+    """
+
+    name = 'sqlite-fts5'
+    TABLE = 'post_fts'
+    TRIGGERS = (
+        """CREATE TRIGGER IF NOT EXISTS post_fts_ai AFTER INSERT ON post BEGIN
+            INSERT INTO post_fts(rowid, title, markdown_content)
+            VALUES (new.id, new.title, new.markdown_content);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS post_fts_ad AFTER DELETE ON post BEGIN
+            INSERT INTO post_fts(post_fts, rowid, title, markdown_content)
+            VALUES ('delete', old.id, old.title, old.markdown_content);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS post_fts_au AFTER UPDATE OF title, markdown_content ON post BEGIN
+            INSERT INTO post_fts(post_fts, rowid, title, markdown_content)
+            VALUES ('delete', old.id, old.title, old.markdown_content);
+            INSERT INTO post_fts(rowid, title, markdown_content)
+            VALUES (new.id, new.title, new.markdown_content);
+        END""",
+    )
+    # bm25()の列ごとの重み（タイトル, 本文）
+    WEIGHTS = (10.0, 1.0)
+
+    def __init__(self):
+        self.tokenizer = None
+        self.fallback = LikeSearchBackend()
+
+    def install(self, engine):
+        with engine.begin() as conn:
+            row = conn.execute(text(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"
+            ), {'name': self.TABLE}).first()
+            if row is None:
+                self.tokenizer = self._create_table(conn)
+                conn.execute(text(f"INSERT INTO {self.TABLE}({self.TABLE}) VALUES ('rebuild')"))
+            else:
+                self.tokenizer = 'trigram' if 'trigram' in row.sql else 'unicode61'
+            for trigger in self.TRIGGERS:
+                conn.execute(text(trigger))
+
+    def _create_table(self, conn):
+        for tokenizer in ('trigram', 'unicode61'):
+            try:
+                with conn.begin_nested():
+                    conn.execute(text(
+                        f'CREATE VIRTUAL TABLE {self.TABLE} USING fts5('
+                        f"title, markdown_content, content='post', content_rowid='id', tokenize='{tokenizer}')"
+                    ))
+                return tokenizer
+            except Exception:
+                # trigramはSQLite 3.34以降のみ
+                continue
+        raise RuntimeError('SQLiteでFTS5を利用できません')
+
+    def search(self, session, query, page=1, per_page=10):
+        terms = split_terms(query)
+        if not terms:
+            return [], False
+        if self.tokenizer == 'trigram' and any(len(term) < 3 for term in terms):
+            # trigramは3文字未満の語を索引から引けないためLIKEで検索する
+            return self.fallback.search(session, query, page, per_page)
+
+        # 入力をそのままMATCHに渡すと構文エラーになりうるため、語ごとにフレーズとして引用する
+        match = ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+        rows = session.execute(text(
+            'SELECT post.id, post.created_at, '
+            f"highlight({self.TABLE}, 0, :open, :close) AS title, "
+            f"snippet({self.TABLE}, 1, :open, :close, '…', 32) AS snippet "
+            f'FROM {self.TABLE} JOIN post ON post.id = {self.TABLE}.rowid '
+            f'WHERE {self.TABLE} MATCH :match '
+            f'ORDER BY bm25({self.TABLE}, {self.WEIGHTS[0]}, {self.WEIGHTS[1]}) '
+            'LIMIT :limit OFFSET :offset'
+        ).columns(created_at=DateTime), {'match': match, 'open': MARK_OPEN, 'close': MARK_CLOSE,
+            'limit': per_page + 1, 'offset': (page - 1) * per_page}).all()
+
+        results = [{
+            'id': row.id,
+            'title': highlight(row.title),
+            'snippet': highlight(row.snippet),
+            'created_at': row.created_at,
+        } for row in rows]
+        return self._paginate(results, per_page)
+
+
+class MySQLFulltextBackend(SearchBackend):
+    """MySQLのFULLTEXTインデックス（ngramパーサー）による全文検索
+
+    インデックスはMySQLが更新時に自動で保守する。
+    """
+
+    name = 'mysql-fulltext'
+    INDEX = 'ft_post_search'
+
+    def install(self, engine):
+        names = {index['name'] for index in inspect(engine).get_indexes('post')}
+        if self.INDEX not in names:
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f'CREATE FULLTEXT INDEX {self.INDEX} ON post (title, markdown_content) WITH PARSER ngram'
+                ))
+
+    def search(self, session, query, page=1, per_page=10):
+        terms = split_terms(query)
+        if not terms:
+            return [], False
+
+        # BOOLEAN MODEで全語を必須のフレーズとして検索
+        against = ' '.join('+"{}"'.format(term.replace('"', '')) for term in terms)
+        rows = session.execute(text(
+            'SELECT id, title, markdown_content, created_at, '
+            'MATCH(title, markdown_content) AGAINST (:against IN BOOLEAN MODE) AS score '
+            'FROM post WHERE MATCH(title, markdown_content) AGAINST (:against IN BOOLEAN MODE) '
+            'ORDER BY score DESC, id DESC LIMIT :limit OFFSET :offset'
+        ).columns(created_at=DateTime), {'against': against, 'limit': per_page + 1, 'offset': (page - 1) * per_page}).all()
+
+        results = [{
+            'id': row.id,
+            'title': highlight(mark_terms(row.title, terms)),
+            'snippet': highlight(make_snippet(row.markdown_content, terms)),
+            'created_at': row.created_at,
+        } for row in rows]
+        return self._paginate(results, per_page)
+
+
+# データベースの種類 -> 検索バックエンド（他のデータベースを追加する場合はここに登録）
+SEARCH_BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'mysql': MySQLFulltextBackend,
+}
+
+
+def create_search_backend(engine, name=None):
+    # name（SEARCH_BACKEND環境変数）で明示された場合はそのバックエンドを使う
+    if name:
+        backends = {cls.name: cls for cls in (*SEARCH_BACKENDS.values(), LikeSearchBackend)}
+        if name not in backends:
+            raise ValueError(f'不明な検索バックエンドです: {name}（{", ".join(sorted(backends))} のいずれかを指定してください）')
+        return backends[name]()
+    return SEARCH_BACKENDS.get(engine.dialect.name, LikeSearchBackend)()
@@ -1,16 +1,21 @@
-from flask import Flask, render_template, redirect, url_for, flash, request
+from flask import Flask, render_template, redirect, url_for, flash, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import inspect, or_, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import validates
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, BooleanField
-from wtforms.validators import DataRequired, Email, EqualTo, ValidationError
+from wtforms.validators import DataRequired, Email, EqualTo
 import os
 from datetime import datetime
+from user_cache import UserCache, create_backend
+from password_policy import create_policy
+from rate_limiter import create_throttle
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///users.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db = SQLAlchemy(app)
@@ -18,24 +23,99 @@ login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'ログインが必要です。'
 
+# パスワードハッシュの方式とコスト（PASSWORD_HASH_METHOD）、検証用スレッド数（PASSWORD_HASH_WORKERS）
+password_policy = create_policy()
+
+# ログイン試行の回数制限（IPアドレス別・ユーザー別、パスワード検証の前に判定）
+login_throttle = create_throttle()
+
 
 class User(UserMixin, db.Model):
+    # 大文字・小文字を区別せずに一意にするため、小文字にそろえた列にユニークインデックスを張る
+    # （登録の重複チェックとログイン時の検索もこの列で行う）
+    __table_args__ = (
+        db.Index('uq_user_username_lower', 'username_lower', unique=True),
+        db.Index('uq_user_email_lower', 'email_lower', unique=True),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
+    username_lower = db.Column(db.String(80), nullable=False)
+    email_lower = db.Column(db.String(120), nullable=False)
+    password_hash = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    @validates('username', 'email')
+    def normalize(self, key, value):
+        setattr(self, f'{key}_lower', normalize_identity(value))
+        return value
+    
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_policy.hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_policy.verify(self.password_hash, password)
+    
+    def check_password_and_rehash(self, password):
+        """パスワードを検証し、ハッシュの方式が古ければ現在の方式で作り直す（要コミット）"""
+        if not self.check_password(password):
+            return False
+        if password_policy.needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
+
+
+def normalize_identity(value):
+    return (value or '').strip().lower()
+
+
+def find_registered(username, email):
+    """ユーザー名・メールアドレスの使用状況を1回のクエリで調べる
+
+    Returns:
+        tuple: (ユーザー名が使用済みか, メールアドレスが使用済みか)
+    """
+    username_lower = normalize_identity(username)
+    email_lower = normalize_identity(email)
+    rows = (db.session.query(User.username_lower, User.email_lower)
+            .filter(or_(User.username_lower == username_lower, User.email_lower == email_lower))
+            .limit(2).all())
+    return (any(row.username_lower == username_lower for row in rows),
+            any(row.email_lower == email_lower for row in rows))
+
+
+def ensure_schema():
+    db.create_all()
+    # 既存のuserテーブルに小文字の列とユニークインデックスを追加する
+    columns = {column['name'] for column in inspect(db.engine).get_columns(User.__tablename__)}
+    table = db.engine.dialect.identifier_preparer.quote(User.__tablename__)
+    with db.engine.begin() as conn:
+        for name, length, source in (('username_lower', 80, 'username'), ('email_lower', 120, 'email')):
+            if name not in columns:
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} VARCHAR({length})'))
+                conn.execute(text(f'UPDATE {table} SET {name} = lower(trim({source}))'))
+    for index in User.__table__.indexes:
+        try:
+            index.create(db.engine, checkfirst=True)
+        except IntegrityError:
+            # 大文字・小文字だけが異なる既存の重複がある場合は、解消するまでインデックスを作成しない
+            app.logger.warning('%s を作成できません（大文字・小文字だけが異なる重複があります）', index.name)
+
+
+# 認証済みリクエストごとのユーザー読み込みをキャッシュする
+# （USER_CACHE_URLにredis://...を指定すると複数プロセスで共有）
+user_cache = UserCache(
+    User,
+    ttl=int(os.environ.get('USER_CACHE_TTL', 300)),
+    backend=create_backend(os.environ.get('USER_CACHE_URL'),
+                           max_entries=int(os.environ.get('USER_CACHE_SIZE', 10000)))
+)
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.load(db.session, int(user_id))
 
 
 class RegistrationForm(FlaskForm):
@@ -45,15 +125,28 @@ class RegistrationForm(FlaskForm):
     password2 = PasswordField('パスワード（確認）', validators=[DataRequired(), EqualTo('password', message='パスワードが一致しません')])
     submit = SubmitField('登録')
     
-    def validate_username(self, username):
-        user = User.query.filter_by(username=username.data).first()
-        if user:
-            raise ValidationError('このユーザー名は既に使用されています。')
+    USERNAME_TAKEN = 'このユーザー名は既に使用されています。'
+    EMAIL_TAKEN = 'このメールアドレスは既に登録されています。'
+    
+    def validate(self, extra_validators=None):
+        if not super().validate(extra_validators):
+            return False
+        # ユーザー名とメールアドレスをまとめて1回のクエリで確認
+        username_taken, email_taken = find_registered(self.username.data, self.email.data)
+        if username_taken:
+            self.username.errors.append(self.USERNAME_TAKEN)
+        if email_taken:
+            self.email.errors.append(self.EMAIL_TAKEN)
+        return not (username_taken or email_taken)
     
-    def validate_email(self, email):
-        user = User.query.filter_by(email=email.data).first()
-        if user:
-            raise ValidationError('このメールアドレスは既に登録されています。')
+    def add_conflict_errors(self):
+        """同時登録でユニークインデックスに違反した場合に、該当する項目のエラーにする"""
+        # エラーメッセージの形式はDBごとに異なるため、登録済みの値を改めて確認する
+        username_taken, email_taken = find_registered(self.username.data, self.email.data)
+        if email_taken:
+            self.email.errors.append(self.EMAIL_TAKEN)
+        if username_taken or not email_taken:
+            self.username.errors.append(self.USERNAME_TAKEN)
 
 
 class LoginForm(FlaskForm):
@@ -78,7 +171,13 @@ def register():
         user = User(username=form.username.data, email=form.email.data)
         user.set_password(form.password.data)
         db.session.add(user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # チェック後に同じユーザー名・メールアドレスが登録された場合はDBの制約で検出
+            db.session.rollback()
+            form.add_conflict_errors()
+            return render_template('register.html', form=form)
         flash('登録が完了しました！ログインしてください。', 'success')
         return redirect(url_for('login'))
     
@@ -92,8 +191,17 @@ def login():
     
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(email=form.email.data).first()
-        if user and user.check_password(form.password.data):
+        allowed, retry_after = login_throttle.check(request.remote_addr, form.email.data)
+        if not allowed:
+            flash(f'ログインの試行回数が多すぎます。{retry_after}秒後にもう一度お試しください。', 'danger')
+            return render_template('login.html', form=form), 429, {'Retry-After': str(retry_after)}
+        
+        user = User.query.filter_by(email_lower=normalize_identity(form.email.data)).first()
+        success = user is not None and user.check_password_and_rehash(form.password.data)
+        login_throttle.record(success)
+        if success:
+            # ハッシュを作り直した場合だけ保存される
+            db.session.commit()
             login_user(user, remember=form.remember_me.data)
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('dashboard'))
@@ -103,6 +211,13 @@ def login():
     return render_template('login.html', form=form)
 
 
+@app.route('/metrics/login')
+@login_required
+def login_metrics():
+    # このプロセスでのログイン試行の集計（拒否 / 検証 / 成功 / 失敗）とユーザーキャッシュのヒット率
+    return jsonify(throttle=login_throttle.stats(), user_cache=user_cache.stats())
+
+
 @app.route('/logout')
 @login_required
 def logout():
@@ -124,7 +239,7 @@ def profile():
 
 
 with app.app_context():
-    db.create_all()
+    ensure_schema()
 
 
 if __name__ == '__main__':
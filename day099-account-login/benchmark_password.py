@@ -0,0 +1,64 @@
+"""パスワードハッシュのコストごとのログイン処理性能ベンチマーク
+
+このマシンで、ハッシュの方式・コストごとに1秒あたり何件のログイン（パスワード検証）を
+処理できるかを計測する。PASSWORD_HASH_METHOD を決める際の目安に使う。
+
+使い方:
+    python benchmark_password.py [計測秒数] [同時ログイン数]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from password_policy import PasswordPolicy
+
+METHODS = [
+    'pbkdf2:sha256:100000',
+    'pbkdf2:sha256:300000',
+    'pbkdf2:sha256:600000',
+    'pbkdf2:sha256:1000000',
+    'scrypt:16384:8:1',
+    'scrypt:32768:8:1',
+    'scrypt:65536:8:1',
+]
+
+
+def measure(method, duration, concurrency):
+    policy = PasswordPolicy(method, max_workers=os.cpu_count() or 1)
+    try:
+        pw_hash = policy.hash('correct horse battery staple')
+
+        # 1件あたりの時間（直列）
+        start = time.perf_counter()
+        policy.verify(pw_hash, 'correct horse battery staple')
+        single_ms = (time.perf_counter() - start) * 1000
+
+        # 同時ログインをconcurrency件ずつ投入し、duration秒間に処理できた件数を数える
+        count = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as clients:
+            while time.perf_counter() - start < duration:
+                futures = [clients.submit(policy.verify, pw_hash, 'correct horse battery staple')
+                           for _ in range(concurrency)]
+                wait(futures)
+                count += len(futures)
+        elapsed = time.perf_counter() - start
+        return single_ms, count / elapsed
+    finally:
+        # 方式ごとに作ったスレッドプールを次の計測の前に停止する
+        policy.shutdown()
+
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1) * 2
+
+    print(f'CPU: {os.cpu_count()}コア / 計測: {duration}秒 / 同時ログイン: {concurrency}件')
+    print(f'{"方式":<24}{"1件あたり":>12}{"ログイン/秒":>14}')
+    for method in METHODS:
+        single_ms, per_sec = measure(method, duration, concurrency)
+        print(f'{method:<24}{single_ms:>9.1f} ms{per_sec:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
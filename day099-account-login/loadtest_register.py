@@ -0,0 +1,71 @@
+"""ユーザー登録の同時実行テスト（負荷テスト）
+
+一時的なSQLiteデータベースに対して、複数のスレッドから同時に登録リクエストを送る。
+
+1. 同じユーザー名・メールアドレス（大文字・小文字違いを含む）での同時登録
+   -> 作成されるアカウントが1件だけで、残りはエラー表示（500エラーにならない）ことを確認
+2. 異なるユーザーの同時登録 -> 1秒あたりの登録件数を計測
+
+使い方:
+    python loadtest_register.py [同時実行数] [登録件数]
+"""
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# アプリのインポート前に一時DBと軽いハッシュ設定にする（登録処理自体の性能を見るため）
+db_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(db_dir, "loadtest.db")}'
+os.environ.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+
+from app import app, User
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+def register(username, email):
+    with app.test_client() as client:
+        response = client.post('/register', data={
+            'username': username, 'email': email,
+            'password': 'password123', 'password2': 'password123',
+        })
+    return response.status_code
+
+
+def duplicate_signups(concurrency):
+    variants = [('Alice' if i % 2 else 'alice', 'ALICE@example.com' if i % 3 else 'alice@example.com')
+                for i in range(concurrency)]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        statuses = list(executor.map(lambda args: register(*args), variants))
+    with app.app_context():
+        created = User.query.filter_by(username_lower='alice').count()
+    print(f'[重複登録] {concurrency}件同時 -> 作成 {created}件 / '
+          f'リダイレクト {statuses.count(302)}件 / エラー表示 {statuses.count(200)}件 / '
+          f'500エラー {statuses.count(500)}件')
+    return created == 1 and statuses.count(302) == 1 and 500 not in statuses
+
+
+def distinct_signups(concurrency, total):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        statuses = list(executor.map(lambda i: register(f'user{i}', f'user{i}@example.com'), range(total)))
+    elapsed = time.perf_counter() - start
+    print(f'[通常登録] {total}件 / 同時{concurrency} -> 成功 {statuses.count(302)}件, '
+          f'{elapsed:.2f}秒 ({total / elapsed:.1f}件/秒)')
+    return statuses.count(302) == total
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    ok = duplicate_signups(concurrency)
+    ok = distinct_signups(concurrency, total) and ok
+    print('OK' if ok else 'NG')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
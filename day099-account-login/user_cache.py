@@ -0,0 +1,164 @@
+# load_user()で引くユーザー行のキャッシュ（app.pyで作成）。day100-fullstack-todoにも同じファイルがある
+import json
+import time
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from sqlalchemy import Date, DateTime, event
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+
+class LocalCacheBackend:
+    """プロセス内のTTL付きLRUキャッシュ"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # キー -> (有効期限, 値)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    """複数プロセス・複数サーバーで共有するキャッシュ（redisパッケージが必要）"""
+
+    def __init__(self, url, prefix='user-cache:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl)))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+def create_backend(url=None, max_entries=10000):
+    """URLが指定されていれば共有キャッシュ、なければプロセス内キャッシュを返す"""
+    if url:
+        return RedisCacheBackend(url)
+    return LocalCacheBackend(max_entries)
+
+
+class UserCache:
+    """Flask-Loginのuser_loader用のユーザー情報キャッシュ
+
+    認証済みリクエストのたびにusersテーブルを読まないよう、ユーザーの列の値を
+    TTL付きでキャッシュし、ヒットした場合はクエリなしでセッションに結び付けて返す。
+
+    - パスワードハッシュなどexcludeに指定した列はキャッシュせず、参照時に読み込む
+    - ユーザーの更新・削除をコミットしたら自動でキャッシュから削除する
+      （Query.update()などの一括更新はイベントが発生しないため、invalidate()を呼ぶこと）
+    """
+
+    def __init__(self, model, ttl=300, backend=None, exclude=('password_hash',)):
+        self.model = model
+        self.ttl = ttl
+        self.backend = backend or LocalCacheBackend()
+        self.columns = [column for column in model.__table__.columns if column.key not in exclude]
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._listen()
+
+    def _key(self, user_id):
+        return str(user_id)
+
+    def load(self, session, user_id):
+        """ユーザーを返す（キャッシュになければデータベースから読み込んでキャッシュ）"""
+        data = self.backend.get(self._key(user_id))
+        if data is not None:
+            with self._lock:
+                self.hits += 1
+            return self._restore(session, data)
+
+        with self._lock:
+            self.misses += 1
+        user = session.get(self.model, user_id)
+        if user is not None:
+            self.backend.set(self._key(user_id), self._dump(user), self.ttl)
+        return user
+
+    def invalidate(self, user_id):
+        self.backend.delete(self._key(user_id))
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / total if total else 0.0}
+
+    def _dump(self, user):
+        data = {}
+        for column in self.columns:
+            value = getattr(user, column.key)
+            if isinstance(value, (datetime, date)):
+                value = value.isoformat()
+            data[column.key] = value
+        return data
+
+    def _restore(self, session, data):
+        values = {}
+        for column in self.columns:
+            value = data.get(column.key)
+            if isinstance(value, str):
+                if isinstance(column.type, DateTime):
+                    value = datetime.fromisoformat(value)
+                elif isinstance(column.type, Date):
+                    value = date.fromisoformat(value)
+            values[column.key] = value
+        user = self.model(**values)
+        # DBから読み込んだ状態として扱い（キャッシュしていない列は参照時に読み込む）、
+        # クエリを発行せずに現在のセッションに結び付ける
+        make_transient_to_detached(user)
+        return session.merge(user, load=False)
+
+    def _listen(self):
+        model = self.model
+
+        @event.listens_for(Session, 'after_flush')
+        def collect_changed_users(session, flush_context):
+            changed = session.info.setdefault('user_cache_changed', set())
+            for obj in list(session.dirty) + list(session.deleted):
+                if isinstance(obj, model) and obj.id is not None:
+                    changed.add(obj.id)
+                    # 他のリクエストがコミット前の古い値を読み込む場合に備えてコミット後にも削除する
+                    self.invalidate(obj.id)
+
+        @event.listens_for(Session, 'after_commit')
+        def invalidate_changed_users(session):
+            for user_id in session.info.pop('user_cache_changed', ()):
+                self.invalidate(user_id)
+
+        @event.listens_for(Session, 'after_rollback')
+        def clear_changed_users(session):
+            session.info.pop('user_cache_changed', None)
@@ -4,12 +4,14 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
 from dotenv import load_dotenv
+from image_processing import ImageQueue
 
 load_dotenv()
 
 db = SQLAlchemy()
 migrate = Migrate()
 login_manager = LoginManager()
+image_queue = ImageQueue()
 
 def create_app():
     app = Flask(__name__)
@@ -19,6 +21,7 @@ def create_app():
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['UPLOAD_FOLDER'] = 'static/uploads'
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+    app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))  # 画像変換のプロセス数
     
     db.init_app(app)
     migrate.init_app(app, db)
@@ -27,6 +30,7 @@ def create_app():
     login_manager.login_message = 'ログインが必要です。'
     
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    image_queue.init_app(app)
     
     from routes.auth import auth_bp
     from routes.todo import todo_bp
@@ -1,16 +1,22 @@
+import sys
 from app import create_app, db
 from models import Todo
-from routes.todo import markdown_to_html
+from markdown_renderer import renderer
 
 app = create_app()
 
+# 使い方: python check_markdown.py [ToDoのID]
+todo_id = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+
 with app.app_context():
-    todo = Todo.query.get(2)
+    todo = db.session.get(Todo, todo_id)
     if todo:
         print("=== Original Description ===")
         print(todo.description)
         print("\n=== Generated HTML ===")
-        html = markdown_to_html(todo.description)
+        html = renderer.convert(todo.description)
         print(html)
         print("\n=== Current HTML in DB ===")
-        print(todo.description_html)
\ No newline at end of file
+        print(todo.description_html)
+        print("\n=== Up to date ===")
+        print(html == (todo.description_html or ''))
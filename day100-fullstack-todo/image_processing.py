@@ -0,0 +1,163 @@
+import os
+import re
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+
+# 派生画像の幅（長辺の上限）と形式。表示にはDISPLAY_SIZEのJPEGを基本に使う
+DERIVATIVE_SIZES = (1600, 800, 320)
+DERIVATIVE_FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+DISPLAY_SIZE = 800
+PENDING_FOLDER = 'pending'
+
+# 派生画像のファイル名: <ランダムな16進数>.w<幅>.<拡張子>
+DERIVATIVE_PATTERN = re.compile(r'^(?P<key>[0-9a-f]+)\.w(?P<size>\d+)\.(?P<ext>jpg|webp)$')
+
+
+def derivative_name(key, size, ext):
+    return f'{key}.w{size}.{ext}'
+
+
+def has_variants(image_path):
+    return bool(DERIVATIVE_PATTERN.match(image_path or ''))
+
+
+def image_variant(image_path, size, ext='jpg'):
+    """派生画像のファイル名を返す（派生画像のない旧形式の画像はそのまま返す）"""
+    match = DERIVATIVE_PATTERN.match(image_path or '')
+    if not match:
+        return image_path
+    return derivative_name(match.group('key'), size, ext)
+
+
+def image_files(image_path):
+    """image_pathに対応する保存済みファイル名の一覧（削除用）"""
+    match = DERIVATIVE_PATTERN.match(image_path or '')
+    if not match:
+        return [image_path] if image_path else []
+    return [derivative_name(match.group('key'), size, ext)
+            for size in DERIVATIVE_SIZES for ext in DERIVATIVE_FORMATS]
+
+
+def remove_image_files(folder, image_path):
+    for name in image_files(image_path):
+        try:
+            os.remove(os.path.join(folder, name))
+        except FileNotFoundError:
+            pass
+
+
+def process_image(upload_path, output_folder, key, quality=85):
+    """ワーカープロセスで実行: アップロードされた画像から派生画像を作成する
+
+    - JPEGはdraft()で必要な解像度だけデコードする
+    - EXIFのOrientationは画素に反映し、EXIF・ICCなどのメタデータは書き出さない
+    - 一時ファイルに書き出してからos.replace()で置き換える
+
+    Returns:
+        str: 表示用の派生画像のファイル名（Todo.image_pathに保存する値）
+    """
+    try:
+        with Image.open(upload_path) as img:
+            if img.format == 'JPEG':
+                img.draft('RGB', (DERIVATIVE_SIZES[0], DERIVATIVE_SIZES[0]))
+            image = ImageOps.exif_transpose(img)
+            image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+        for size in DERIVATIVE_SIZES:
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+            for ext, image_format in DERIVATIVE_FORMATS.items():
+                output = resized
+                if image_format == 'JPEG' and output.mode == 'RGBA':
+                    # JPEGは透過に対応しないため白背景に合成
+                    background = Image.new('RGB', output.size, (255, 255, 255))
+                    background.paste(output, mask=output.getchannel('A'))
+                    output = background
+                path = os.path.join(output_folder, derivative_name(key, size, ext))
+                tmp_path = f'{path}.tmp'
+                output.save(tmp_path, format=image_format, quality=quality, optimize=True)
+                os.replace(tmp_path, path)
+    finally:
+        os.remove(upload_path)
+    return derivative_name(key, DISPLAY_SIZE, 'jpg')
+
+
+class ImageQueue:
+    """アップロード画像の変換をリクエストの外で行うワーカープール
+
+    アップロードはsave_upload()でディスクにそのまま書き出すだけにして、
+    リサイズ・形式変換はsubmit()でプロセスプールに任せる。
+    完了時のコールバックはアプリケーションコンテキスト内で呼び出す。
+    """
+
+    def __init__(self, app=None, max_workers=2):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = {}  # ジョブID（ToDoのidなど） -> 最後に受け付けた画像のキー
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_workers = app.config.get('IMAGE_WORKERS', self.max_workers)
+        self.output_folder = os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
+        self.pending_folder = os.path.join(self.output_folder, PENDING_FOLDER)
+        os.makedirs(self.pending_folder, exist_ok=True)
+
+    def save_upload(self, file_storage):
+        """アップロードされたファイルを変換せずに保存する（チャンク単位で書き込み）
+
+        Returns:
+            tuple: (保存先のパス, 派生画像のファイル名に使うキー)
+        """
+        key = secrets.token_hex(8)
+        path = os.path.join(self.pending_folder, f'{key}.upload')
+        file_storage.save(path)
+        return path, key
+
+    def submit(self, job_id, upload_path, key, on_done):
+        """派生画像の作成を開始し、完了したら on_done(派生画像のファイル名) を呼ぶ
+
+        失敗した場合は on_done(None) を呼ぶ。同じjob_idに新しい画像が送られた場合、
+        古い方の結果は破棄してon_doneを呼ばない。
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            self._pending[job_id] = key
+            future = self._executor.submit(process_image, upload_path, self.output_folder, key)
+
+        def callback(future):
+            image_path = None
+            try:
+                if not future.cancelled():
+                    if future.exception():
+                        self.app.logger.error('画像の変換に失敗しました: %s', future.exception())
+                    else:
+                        image_path = future.result()
+                with self._lock:
+                    latest = self._pending.get(job_id) == key
+                    if latest:
+                        del self._pending[job_id]
+                if not latest:
+                    remove_image_files(self.output_folder, image_path)
+                    return
+                with self.app.app_context():
+                    on_done(image_path)
+            except Exception:
+                self.app.logger.exception('画像の変換結果を保存できませんでした')
+
+        future.add_done_callback(callback)
+
+    def is_pending(self, job_id):
+        with self._lock:
+            return job_id in self._pending
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
@@ -0,0 +1,119 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import markdown2
+import bleach
+
+ALLOWED_TAGS = [
+    'p', 'br', 'strong', 'em', 'u', 'i', 'b', 'code', 'pre',
+    'blockquote', 'ul', 'ol', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'a', 'img', 'hr', 'table', 'thead', 'tbody', 'tr', 'th', 'td',
+    'input', 'del', 's'
+]
+ALLOWED_ATTRIBUTES = {
+    'a': ['href', 'title'],
+    'img': ['src', 'alt', 'title'],
+    'input': ['type', 'checked', 'disabled']
+}
+MARKDOWN_EXTRAS = [
+    'fenced-code-blocks',
+    'tables',
+    'break-on-newline',
+    'header-ids',
+    'strike',
+    'task_list',
+    'code-friendly'
+]
+
+# インデントされた見出しの行頭の空白（Markdownの見出しは行頭になければならない）
+INDENTED_HEADING = re.compile(r'^[^\S\n]+(?=#+[^\S\n])', re.MULTILINE)
+
+
+class MarkdownRenderer:
+    """MarkdownをサニタイズしたHTMLに変換する
+
+    markdown2の変換器とbleachのCleanerは一度だけ作って使い回す
+    （どちらもスレッドセーフではないため、スレッドごとに1つずつ持つ）。
+    変換結果は本文のSHA-256をキーにしたLRUキャッシュに保持する。
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()  # 本文のハッシュ -> HTML
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    def _tools(self):
+        local = self._local
+        if not hasattr(local, 'converter'):
+            local.converter = markdown2.Markdown(extras=MARKDOWN_EXTRAS)
+            local.cleaner = bleach.Cleaner(tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, strip=True)
+        return local.converter, local.cleaner
+
+    def convert(self, text):
+        """キャッシュを使わずに変換する"""
+        if not text:
+            return ''
+        converter, cleaner = self._tools()
+        html = converter.convert(INDENTED_HEADING.sub('', text))
+        return cleaner.clean(str(html))
+
+    def render(self, text):
+        if not text:
+            return ''
+        key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        with self._lock:
+            html = self._cache.get(key)
+            if html is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+
+        html = self.convert(text)
+        with self._lock:
+            self._cache[key] = html
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return html
+
+    def render_many(self, texts, workers=None, executor=None):
+        """複数の本文をプロセスプールで並列に変換する（結果は入力と同じ順）
+
+        何度も呼ぶ場合は呼び出し側で作ったプール（executor）を渡して使い回す。
+        渡さない場合はこの呼び出しのためだけにプールを作る。workers=1なら直列に変換する。
+        """
+        texts = list(texts)
+        if workers == 1:
+            return [self.render(text) for text in texts]
+        if executor is None:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                return self.render_many(texts, workers, executor)
+        # 各プロセスに数回ずつ分けて渡せるよう、件数とプロセス数からまとめる件数を決める
+        chunksize = max(1, len(texts) // ((workers or os.cpu_count() or 1) * 4))
+        return list(executor.map(_render_in_worker, texts, chunksize=chunksize))
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._cache), 'hits': self.hits, 'misses': self.misses}
+
+
+renderer = MarkdownRenderer()
+
+
+def _render_in_worker(text):
+    # ProcessPoolExecutorから呼ばれるためモジュール直下に定義（各プロセスのrendererを使う）
+    return renderer.render(text)
+
+
+def markdown_to_html(text):
+    return renderer.render(text)
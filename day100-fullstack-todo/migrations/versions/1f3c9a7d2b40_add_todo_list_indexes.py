@@ -0,0 +1,36 @@
+"""add composite indexes for the todo list
+
+Revision ID: 1f3c9a7d2b40
+Revises: 
+Create Date: 2026-10-18 15:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1f3c9a7d2b40'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'ix_todos_user_created': ['user_id', 'created_at', 'id'],
+    'ix_todos_user_completed_created': ['user_id', 'completed', 'created_at', 'id'],
+    'ix_todos_user_due_date': ['user_id', 'due_date'],
+}
+
+
+def upgrade():
+    # テーブルはrun.pyのdb.create_all()で作成されるため、インデックスだけを追加する
+    # （create_all()で作成済みの新しいDBでは何もしない）
+    existing = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('todos')}
+    for name, columns in INDEXES.items():
+        if name not in existing:
+            op.create_index(name, 'todos', columns)
+
+
+def downgrade():
+    for name in INDEXES:
+        op.drop_index(name, table_name='todos')
@@ -1,7 +1,14 @@
+import os
 from datetime import datetime, timezone, timedelta
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-from app import db, login_manager
+from sqlalchemy.orm import query_expression
+from app import db, login_manager, image_queue
+from image_processing import image_variant, has_variants
+from user_cache import UserCache, create_backend
+from password_policy import create_policy
+
+# パスワードハッシュの方式とコスト（PASSWORD_HASH_METHOD）、検証用スレッド数（PASSWORD_HASH_WORKERS）
+password_policy = create_policy()
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -15,13 +22,28 @@ class User(UserMixin, db.Model):
     todos = db.relationship('Todo', backref='user', lazy='dynamic', cascade='all, delete-orphan')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_policy.hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_policy.verify(self.password_hash, password)
+    
+    def check_password_and_rehash(self, password):
+        """パスワードを検証し、ハッシュの方式が古ければ現在の方式で作り直す（要コミット）"""
+        if not self.check_password(password):
+            return False
+        if password_policy.needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
 
 class Todo(db.Model):
     __tablename__ = 'todos'
+    # 一覧（ユーザーごとの作成日時順）と絞り込み用の複合インデックス
+    # （migrations/versions/1f3c9a7d2b40_add_todo_list_indexes.py で既存のDBにも追加）
+    __table_args__ = (
+        db.Index('ix_todos_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_todos_user_completed_created', 'user_id', 'completed', 'created_at', 'id'),
+        db.Index('ix_todos_user_due_date', 'user_id', 'due_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -34,6 +56,22 @@ class Todo(db.Model):
     due_date = db.Column(db.Date)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # 一覧表示用の説明の先頭部分（with_expression()で指定した場合のみ読み込む）
+    description_preview = query_expression()
+
+    def image_variant(self, size, ext='jpg'):
+        """指定した幅・形式の派生画像のファイル名"""
+        return image_variant(self.image_path, size, ext)
+    
+    @property
+    def image_has_variants(self):
+        """サイズ・形式別の派生画像があるか（旧バージョンでアップロードされた画像はFalse）"""
+        return has_variants(self.image_path)
+    
+    @property
+    def image_pending(self):
+        """アップロードされた画像を変換中かどうか"""
+        return image_queue.is_pending(self.id)
 
     def get_jst_created_at(self):
         """作成日時をJSTで返す"""
@@ -45,6 +83,15 @@ class Todo(db.Model):
         jst = timezone(timedelta(hours=9))
         return self.updated_at.replace(tzinfo=timezone.utc).astimezone(jst)
 
+# 認証済みリクエストごとのユーザー読み込みをキャッシュする
+# （USER_CACHE_URLにredis://...を指定すると複数プロセスで共有）
+user_cache = UserCache(
+    User,
+    ttl=int(os.environ.get('USER_CACHE_TTL', 300)),
+    backend=create_backend(os.environ.get('USER_CACHE_URL'),
+                           max_entries=int(os.environ.get('USER_CACHE_SIZE', 10000)))
+)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
\ No newline at end of file
+    return user_cache.load(db.session, int(user_id))
\ No newline at end of file
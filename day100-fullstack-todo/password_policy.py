@@ -0,0 +1,58 @@
+# パスワードのハッシュと検証（models.pyのUserから使う）。day099-account-loginにも同じファイルがある
+import os
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# werkzeugの既定（scrypt:32768:8:1）と同じ。コストを変える場合は環境変数で指定する
+#   例: PASSWORD_HASH_METHOD=scrypt:65536:8:1 / pbkdf2:sha256:600000
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+
+class PasswordPolicy:
+    """パスワードハッシュの方式（アルゴリズムとコスト）と検証処理をまとめたもの
+
+    - hash() は現在の方式でハッシュを作成する
+    - needs_rehash() は保存済みのハッシュが現在の方式と異なるかを判定する
+      （ログイン成功時に平文のパスワードがある間に作り直すために使う）
+    - verify() はハッシュの検証を専用のスレッドプールで行い、同時に実行するKDFの数を
+      max_workersまでに抑える（ログインが集中してもCPUを奪い合わない）。
+      呼び出したスレッドは結果が出るまで待つので、リクエスト処理のスレッドは検証の間ふさがったまま。
+      待たずに済ませたい場合は verify_async() のFutureを使う
+      （hashlibのscrypt/pbkdf2はGILを解放するので、複数コアで並列に計算される）
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, salt_length=16, max_workers=None):
+        self.salt_length = salt_length
+        # 'scrypt' のような省略形も、実際に保存される形式（scrypt:32768:8:1）にそろえる
+        self.method = generate_password_hash('', method, salt_length).split('$', 1)[0]
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix='password-verify')
+
+    def hash(self, password):
+        return generate_password_hash(password, self.method, self.salt_length)
+
+    def needs_rehash(self, pw_hash):
+        return not pw_hash or pw_hash.split('$', 1)[0] != self.method
+
+    def verify_async(self, pw_hash, password):
+        """検証をスレッドプールに投入してFutureを返す"""
+        return self._executor.submit(check_password_hash, pw_hash or '', password)
+
+    def verify(self, pw_hash, password, timeout=None):
+        if not pw_hash:
+            return False
+        return self.verify_async(pw_hash, password).result(timeout)
+
+    def shutdown(self):
+        """検証用のスレッドプールを停止する（実行中の検証は完了を待つ）"""
+        self._executor.shutdown(wait=True)
+
+
+def create_policy():
+    """環境変数 PASSWORD_HASH_METHOD / PASSWORD_HASH_WORKERS から作成する"""
+    workers = os.environ.get('PASSWORD_HASH_WORKERS')
+    return PasswordPolicy(
+        method=os.environ.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD),
+        max_workers=int(workers) if workers else None,
+    )
@@ -0,0 +1,142 @@
+# ログイン試行の制限（routes/auth.pyのlogin()で使う、キーはIPとユーザー名）。day099-account-loginにも同じファイルがある
+import math
+import os
+import time
+import threading
+from collections import OrderedDict
+
+
+class LocalBucketBackend:
+    """プロセス内のトークンバケット（キーが多すぎる場合は古いものから破棄）"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # キー -> (残りトークン, 最終更新時刻)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill_per_sec, now=None):
+        """トークンを1つ消費する
+
+        Returns:
+            tuple: (許可されたか, 次にトークンが1つ貯まるまでの秒数)
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill_per_sec)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        retry_after = 0.0 if allowed else (1 - tokens) / refill_per_sec
+        return allowed, retry_after
+
+
+class RedisBucketBackend:
+    """複数プロセス・複数サーバーで共有するトークンバケット（redisパッケージが必要）
+
+    読み取りから書き込みまでをLuaスクリプトで1回の操作として実行する。
+    """
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + (now - updated) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url, prefix='login-throttle:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._script = self.client.register_script(self.SCRIPT)
+
+    def take(self, key, capacity, refill_per_sec, now=None):
+        now = time.time() if now is None else now
+        allowed, tokens = self._script(keys=[self.prefix + key], args=[capacity, refill_per_sec, now])
+        allowed = bool(int(allowed))
+        retry_after = 0.0 if allowed else (1 - float(tokens)) / refill_per_sec
+        return allowed, retry_after
+
+
+def create_backend(url=None):
+    """URLが指定されていれば共有バックエンド、なければプロセス内のバケットを返す"""
+    if url:
+        return RedisBucketBackend(url)
+    return LocalBucketBackend()
+
+
+class LoginThrottle:
+    """ログイン試行の回数制限（IPアドレス別・ユーザー別のトークンバケット）
+
+    パスワードの検証（重いハッシュ計算）の前にcheck()を呼び、拒否された試行は
+    ハッシュを計算せずに返す。各バケットはlimit回まで連続で試行でき、
+    period秒でlimit回分まで回復する。
+    """
+
+    def __init__(self, backend=None, ip_limit=20, ip_period=60, user_limit=5, user_period=60):
+        self.backend = backend or LocalBucketBackend()
+        self.ip_limit = ip_limit
+        self.ip_rate = ip_limit / ip_period
+        self.user_limit = user_limit
+        self.user_rate = user_limit / user_period
+        self._lock = threading.Lock()
+        self._counters = {'rejected_ip': 0, 'rejected_user': 0, 'verified': 0,
+                          'succeeded': 0, 'failed': 0}
+
+    def check(self, ip, username):
+        """試行を許可するか判定する
+
+        Returns:
+            tuple: (許可されたか, 再試行できるまでの秒数)
+        """
+        allowed, retry_after = self.backend.take(f'ip:{ip}', self.ip_limit, self.ip_rate)
+        if not allowed:
+            self._count('rejected_ip')
+            return False, math.ceil(retry_after)
+        allowed, retry_after = self.backend.take(f'user:{(username or "").strip().lower()}',
+                                                 self.user_limit, self.user_rate)
+        if not allowed:
+            self._count('rejected_user')
+            return False, math.ceil(retry_after)
+        self._count('verified')
+        return True, 0
+
+    def record(self, success):
+        """許可した試行の結果を記録する（メトリクス用）"""
+        self._count('succeeded' if success else 'failed')
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['rejected'] = stats['rejected_ip'] + stats['rejected_user']
+        return stats
+
+
+def create_throttle():
+    """環境変数 LOGIN_IP_LIMIT / LOGIN_USER_LIMIT / LOGIN_*_PERIOD / RATE_LIMIT_URL から作成する"""
+    return LoginThrottle(
+        backend=create_backend(os.environ.get('RATE_LIMIT_URL')),
+        ip_limit=int(os.environ.get('LOGIN_IP_LIMIT', 20)),
+        ip_period=float(os.environ.get('LOGIN_IP_PERIOD', 60)),
+        user_limit=int(os.environ.get('LOGIN_USER_LIMIT', 5)),
+        user_period=float(os.environ.get('LOGIN_USER_PERIOD', 60)),
+    )
@@ -1,12 +1,15 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash
 from app import db
-from models import User
+from models import User, user_cache
 from forms import LoginForm, RegisterForm
+from rate_limiter import create_throttle
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+# ログイン試行の回数制限（IPアドレス別・ユーザー別、パスワード検証の前に判定）
+login_throttle = create_throttle()
+
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
@@ -14,8 +17,17 @@ def login():
     
     form = LoginForm()
     if form.validate_on_submit():
+        allowed, retry_after = login_throttle.check(request.remote_addr, form.username.data)
+        if not allowed:
+            flash(f'ログインの試行回数が多すぎます。{retry_after}秒後にもう一度お試しください。', 'danger')
+            return render_template('auth/login.html', form=form), 429, {'Retry-After': str(retry_after)}
+        
         user = User.query.filter_by(username=form.username.data).first()
-        if user and user.check_password(form.password.data):
+        success = user is not None and user.check_password_and_rehash(form.password.data)
+        login_throttle.record(success)
+        if success:
+            # ハッシュを作り直した場合だけ保存される
+            db.session.commit()
             login_user(user, remember=form.remember_me.data)
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('todo.index'))
@@ -48,4 +60,10 @@ def register():
 def logout():
     logout_user()
     flash('ログアウトしました。', 'info')
-    return redirect(url_for('auth.login'))
\ No newline at end of file
+    return redirect(url_for('auth.login'))
+
+@auth_bp.route('/metrics')
+@login_required
+def metrics():
+    # このプロセスでのログイン試行の集計（拒否 / 検証 / 成功 / 失敗）とユーザーキャッシュのヒット率
+    return jsonify(throttle=login_throttle.stats(), user_cache=user_cache.stats())
\ No newline at end of file
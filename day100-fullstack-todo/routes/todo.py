@@ -1,81 +1,103 @@
 import os
-import secrets
-from datetime import datetime
+from datetime import datetime, date
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
-from PIL import Image
-import markdown2
-import bleach
-from app import db
+from sqlalchemy import func, or_, and_
+from sqlalchemy.orm import load_only, with_expression
+from app import db, image_queue
 from models import Todo
+from image_processing import remove_image_files
 from forms import TodoForm
+from markdown_renderer import markdown_to_html
 
 todo_bp = Blueprint('todo', __name__)
 
-ALLOWED_TAGS = [
-    'p', 'br', 'strong', 'em', 'u', 'i', 'b', 'code', 'pre',
-    'blockquote', 'ul', 'ol', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
-    'a', 'img', 'hr', 'table', 'thead', 'tbody', 'tr', 'th', 'td',
-    'input', 'del', 's'
-]
-ALLOWED_ATTRIBUTES = {
-    'a': ['href', 'title'],
-    'img': ['src', 'alt', 'title'],
-    'input': ['type', 'checked', 'disabled']
-}
+TODOS_PER_PAGE = 30
+PREVIEW_LENGTH = 100
+PRIORITIES = ('high', 'medium', 'low')
 
-def save_image(form_image):
-    if not form_image:
+def parse_date(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
         return None
-    
-    random_hex = secrets.token_hex(8)
-    _, f_ext = os.path.splitext(form_image.filename)
-    image_fn = random_hex + f_ext
-    image_path = os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'], image_fn)
-    
-    img = Image.open(form_image)
-    if img.height > 800 or img.width > 800:
-        output_size = (800, 800)
-        img.thumbnail(output_size)
-    img.save(image_path)
-    
-    return image_fn
 
-def markdown_to_html(text):
-    if not text:
-        return ''
-    
-    # インデントされた見出しを修正（Markdownの見出しは行頭になければならない）
-    import re
-    # 行頭のスペースを削除（見出しとリストアイテムのみ）
-    lines = text.split('\n')
-    cleaned_lines = []
-    for line in lines:
-        # 見出し（#で始まる）の場合、先頭のスペースを削除
-        if re.match(r'^\s*#+\s', line):
-            line = line.lstrip()
-        cleaned_lines.append(line)
+def encode_cursor(todo):
+    return f'{todo.created_at.isoformat()}_{todo.id}'
+
+def decode_cursor(cursor):
+    try:
+        created_at, todo_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(todo_id)
+    except (AttributeError, ValueError):
+        return None
+
+def get_list_filters(args):
+    # 指定された条件だけを返す（不正な値は「指定なし」として無視）
+    filters = {}
+    if args.get('completed') in ('0', '1'):
+        filters['completed'] = args['completed']
+    if args.get('priority') in PRIORITIES:
+        filters['priority'] = args['priority']
+    for key in ('due_from', 'due_to'):
+        if parse_date(args.get(key)):
+            filters[key] = args[key]
+    return filters
+
+def upload_folder():
+    return os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'])
+
+def queue_image(todo, form_image):
+    # アップロードはディスクに書き出すだけにして、変換はバックグラウンドで行う
+    upload_path, key = image_queue.save_upload(form_image)
+    todo_id = todo.id
+    previous_image = todo.image_path
     
-    cleaned_text = '\n'.join(cleaned_lines)
+    def on_done(image_path):
+        if image_path is None:
+            return
+        # 変換中にToDoが削除されていたら作成した画像も削除
+        updated = Todo.query.filter_by(id=todo_id).update({'image_path': image_path},
+                                                          synchronize_session=False)
+        db.session.commit()
+        folder = upload_folder()
+        remove_image_files(folder, previous_image if updated else image_path)
     
-    html = markdown2.markdown(cleaned_text, extras=[
-        'fenced-code-blocks', 
-        'tables', 
-        'break-on-newline',
-        'header-ids',
-        'strike',
-        'task_list',
-        'code-friendly'
-    ])
-    clean_html = bleach.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, strip=True)
-    return clean_html
+    image_queue.submit(todo_id, upload_path, key, on_done)
 
 @todo_bp.route('/')
 @login_required
 def index():
-    todos = Todo.query.filter_by(user_id=current_user.id).order_by(Todo.created_at.desc()).all()
-    return render_template('todo/index.html', todos=todos)
+    filters = get_list_filters(request.args)
+    
+    # 一覧に表示する列と説明の先頭部分だけを読み込む（description / description_htmlは読まない）
+    query = (Todo.query
+             .options(load_only(Todo.id, Todo.title, Todo.image_path, Todo.completed, Todo.priority,
+                                Todo.due_date, Todo.created_at),
+                      with_expression(Todo.description_preview,
+                                      func.substr(Todo.description, 1, PREVIEW_LENGTH + 1)))
+             .filter(Todo.user_id == current_user.id))
+    if 'completed' in filters:
+        query = query.filter(Todo.completed == (filters['completed'] == '1'))
+    if 'priority' in filters:
+        query = query.filter(Todo.priority == filters['priority'])
+    if 'due_from' in filters:
+        query = query.filter(Todo.due_date >= parse_date(filters['due_from']))
+    if 'due_to' in filters:
+        query = query.filter(Todo.due_date <= parse_date(filters['due_to']))
+    
+    # (created_at, id) のキーセット方式。OFFSETを使わないため何ページ目でも同じコスト
+    position = decode_cursor(request.args.get('cursor'))
+    if position:
+        created_at, todo_id = position
+        query = query.filter(or_(Todo.created_at < created_at,
+                                 and_(Todo.created_at == created_at, Todo.id < todo_id)))
+    
+    todos = query.order_by(Todo.created_at.desc(), Todo.id.desc()).limit(TODOS_PER_PAGE + 1).all()
+    next_cursor = encode_cursor(todos[TODOS_PER_PAGE - 1]) if len(todos) > TODOS_PER_PAGE else None
+    return render_template('todo/index.html', todos=todos[:TODOS_PER_PAGE], filters=filters,
+                           next_cursor=next_cursor, is_first_page=position is None)
 
 @todo_bp.route('/create', methods=['GET', 'POST'])
 @login_required
@@ -93,12 +115,11 @@ def create():
         if form.description.data:
             todo.description_html = markdown_to_html(form.description.data)
         
-        if form.image.data:
-            image_file = save_image(form.image.data)
-            todo.image_path = image_file
-        
         db.session.add(todo)
         db.session.commit()
+        
+        if form.image.data:
+            queue_image(todo, form.image.data)
         flash('ToDoを作成しました。', 'success')
         return redirect(url_for('todo.index'))
     
@@ -118,19 +139,14 @@ def edit(id):
         todo.description = form.description.data
         todo.priority = form.priority.data
         todo.due_date = form.due_date.data
+        # 説明を空にした場合も古いHTMLが残らないよう常に更新
+        todo.description_html = markdown_to_html(form.description.data)
         
-        if form.description.data:
-            todo.description_html = markdown_to_html(form.description.data)
+        db.session.commit()
         
         if form.image.data:
-            if todo.image_path:
-                old_image = os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'], todo.image_path)
-                if os.path.exists(old_image):
-                    os.remove(old_image)
-            image_file = save_image(form.image.data)
-            todo.image_path = image_file
-        
-        db.session.commit()
+            # 古い画像は新しい画像の変換が終わった時点で削除する
+            queue_image(todo, form.image.data)
         flash('ToDoを更新しました。', 'success')
         return redirect(url_for('todo.index'))
     
@@ -162,10 +178,7 @@ def delete(id):
         flash('このToDoを削除する権限がありません。', 'danger')
         return redirect(url_for('todo.index'))
     
-    if todo.image_path:
-        image_path = os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'], todo.image_path)
-        if os.path.exists(image_path):
-            os.remove(image_path)
+    remove_image_files(upload_folder(), todo.image_path)
     
     db.session.delete(todo)
     db.session.commit()
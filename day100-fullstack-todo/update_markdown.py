@@ -1,15 +1,67 @@
+"""すべてのToDoのdescription_htmlを再生成する
+
+Markdownの変換設定（markdown_renderer.py）を変えた後や、既存データのHTMLを作り直す場合に実行する。
+ToDoをidの順にbatch-size件ずつ読み込み、複数プロセスで変換して1トランザクションずつ保存する。
+プロセスプールは最初に1度だけ作り、すべてのバッチで使い回す。
+
+使い方:
+    python update_markdown.py [--workers N] [--batch-size N] [--missing-only]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import update
+from sqlalchemy.orm import load_only
 from app import create_app, db
 from models import Todo
-from routes.todo import markdown_to_html
-
-app = create_app()
-
-with app.app_context():
-    todos = Todo.query.all()
-    for todo in todos:
-        if todo.description:
-            todo.description_html = markdown_to_html(todo.description)
-            print(f"Updated Todo #{todo.id}: {todo.title}")
-    
-    db.session.commit()
-    print("すべてのToDoのMarkdownを更新しました。")
\ No newline at end of file
+from markdown_renderer import renderer
+
+
+def rerender_all(workers, batch_size, missing_only=False):
+    if workers == 1:
+        return _rerender_batches(workers, None, batch_size, missing_only)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return _rerender_batches(workers, executor, batch_size, missing_only)
+
+
+def _rerender_batches(workers, executor, batch_size, missing_only):
+    updated = 0
+    last_id = 0
+    while True:
+        query = (Todo.query.options(load_only(Todo.id, Todo.description))
+                 .filter(Todo.id > last_id, Todo.description.isnot(None), Todo.description != ''))
+        if missing_only:
+            query = query.filter((Todo.description_html.is_(None)) | (Todo.description_html == ''))
+        todos = query.order_by(Todo.id).limit(batch_size).all()
+        if not todos:
+            break
+
+        htmls = renderer.render_many([todo.description for todo in todos], workers, executor)
+        db.session.execute(update(Todo), [
+            {'id': todo.id, 'description_html': html} for todo, html in zip(todos, htmls)
+        ])
+        db.session.commit()
+        updated += len(todos)
+        last_id = todos[-1].id
+        print(f'{updated}件を更新しました（〜ToDo #{last_id}）')
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ToDoのMarkdownをHTMLに一括変換します')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='変換に使うプロセス数')
+    parser.add_argument('--batch-size', type=int, default=500, help='1トランザクションで更新する件数')
+    parser.add_argument('--missing-only', action='store_true', help='description_htmlが空のToDoだけ変換する')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        start = time.perf_counter()
+        updated = rerender_all(args.workers, args.batch_size, args.missing_only)
+        elapsed = time.perf_counter() - start
+        print(f'すべてのToDoのMarkdownを更新しました。{updated}件 / {elapsed:.2f}秒')
+
+
+if __name__ == '__main__':
+    main()